@@ -42,21 +42,39 @@ Blender(TM) to NVIDIA Gelato(TM) scene converter
 
 import Blender
 import sys, os, shutil, subprocess
-import datetime, fnmatch, uuid
+import datetime, time, fnmatch, uuid, threading
 import math, copy, re
 import tempfile, ctypes
 import getpass, socket
-import xml.dom.minidom
+import hashlib, array, cPickle, cStringIO
+import xml.sax.saxutils
+
+try:
+	import xml.etree.cElementTree as ElementTree
+except ImportError:
+	import xml.etree.ElementTree as ElementTree
 
 #import pychecker.checker
 
 WINDOWS = (sys.platform[:3] == 'win')
 
+# #include "file" or <file>
+
+RE_INCLUDE = re.compile(r'\s*#\s*include\s*[<"]([^>"]+)[>"]')
+
+STORE_DIRECTORY = 'store'
+
+# shaders signatures on disk (created by main), bump the version when the reading changes
+
+SHADER_CACHE_VERSION = 5
+
+shader_cache = None
+
 try:
-	import xml.dom.ext
-	USE_XML_DOM_EXT = True
-except:
-	USE_XML_DOM_EXT = False
+	import gelatosnap
+	USE_GELATOSNAP = True
+except ImportError:
+	USE_GELATOSNAP = False
 
 class GelatoError(Exception):
 	def __init__(self, message):
@@ -140,15 +158,19 @@ class OpenTempRename(object):
 class ProgressBar(object):
 	__slots__ = ['width', 'count_min', 'count_max', 'message', \
 		'length', 'buffer', 'convert', 'middle', \
-		'enable_percent', 'percent', 'first',]
+		'enable_percent', 'percent', 'first', 'interval', 'last',]
 
-	def __init__(self, width):
+	def __init__(self, width, interval = 0.1):
 		"""
-		Progress bar for Blebder's GUI or ASCII-art
+		Progress bar for Blebder's GUI or ASCII-art,
+		it is drawn at most once every interval seconds
 		"""
 
 		self.width = (2 if (width < 2) else width - 2)
 
+		self.interval = interval
+		self.last     = 0.0
+
 		self.setup()
 
 	def setup(self, count_min = 0, count_max = 0, message = None, count_default = 0, enable_percent = True):
@@ -169,6 +191,8 @@ class ProgressBar(object):
 
 		self.first = (True if (self.message) else False)
 
+		self.last = 0.0
+
 		self.update(count_default)
 
 		if (INTERACTIVE):
@@ -215,6 +239,15 @@ class ProgressBar(object):
 		Write to stdout and print a carriage return first
 		"""
 
+		# skip until the interval is elapsed, the last value is always drawn
+
+		now = Blender.sys.time()
+
+		if (((now - self.last) < self.interval) and (value < self.count_max)):
+			return
+
+		self.last = now
+
 		self.update(value)
 
 		if (INTERACTIVE):
@@ -579,6 +612,7 @@ class GUI_Menu(GUI_Value):
 
 class Sbase(object):
 	verbose = 1
+	redraw  = True
 	parameter_width = 210
 	button_default_space = 550
 	button_default_width = 100
@@ -588,8 +622,12 @@ class Sbase(object):
 	literals = EnumType('float', 'string', 'color', 'point', 'vector', 'normal', 'matrix')
 	types    = EnumType('surface', 'displacement', 'volume', 'light', 'generic')
 
-	color_text    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.0, 0.0, 0.0])
-	color_evident = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [1.0, 1.0, 0.8])
+	if (Blender.mode == 'interactive'):
+		color_text    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.0, 0.0, 0.0])
+		color_evident = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [1.0, 1.0, 0.8])
+	else:
+		color_text    = None
+		color_evident = None
 
 	# ${name[:digits]}
 	re_variables = re.compile('(?<!\$)\$\{([a-zA-Z_]\w*)(?:\:(\d+))?\}')
@@ -618,7 +656,7 @@ class Sbase(object):
 class Shader(object):
 
 	class Parameter(object):
-		__slots__ = ['type', 'default', 'type_name', 'name', '_val', '_change', '_gui_parameter']
+		__slots__ = ['type', 'default', 'type_name', 'name']
 
 		def __init__(self, type, default, type_name, name):
 			self.type      = type
@@ -626,62 +664,31 @@ class Shader(object):
 			self.type_name = type_name
 			self.name      = name
 
-			self._val    = default
-			self._change = False
+	class Schema(object):
+		__slots__ = ['info', 'type', 'name', 'parameters']
 
-			self._gui_parameter = None
+		def __init__(self, info):
+			"""
+			Type, name and parameters of a shader file,
+			shared (read-only) by all its instances
+			"""
 
-		def __deepcopy__(self, memo = {}):
-			new_parameter = Shader.Parameter.__new__(Shader.Parameter)
-			memo[id(self)] = new_parameter
+			self.info = info
 
-			for attr_name in self.__slots__:
+			(self.type, self.name, parameters) = info
 
-				if (attr_name == '_gui_parameter'):
-					value = None
-				else:
-					value = getattr(self, attr_name)
-
-				setattr(new_parameter, attr_name, value)
-
-			return new_parameter
-
-		@property
-		def change(self):
-			return self._change
-
-		@apply
-		def val():
-			def fget(self):
-				return self._val
-
-			def fset(self, value):
-				self._change = True
-				self._val    = value
-
-			return property(**locals())
-
-		def setdefault(self):
-			self._change = False
-			self._val    = self.default
+			self.parameters = {}
+			for (lit, default, par_name) in parameters:
+				self.parameters[par_name] = Shader.Parameter(lit, default, Sbase.literals[lit], par_name)
 
-		def cb_parameter(self, event, val):
-			self.val = val
+	# schemas by file name
 
-		def draw(self):
-			if (self._gui_parameter is None):
-				help = self.type_name + ' ' + self.name
-				if (self.default):
-					help += ' (default: %s)' % self.default
+	schemas = {}
 
-				self._gui_parameter = GUI_String('shader', None, self.name + ': ', Sbase.parameter_width, 128, func = self.cb_parameter, help = help)
-
-			self._gui_parameter.draw(self.val)
-
-	__slots__ = ['filename', 'nameid', 'type', 'name', 'parameters', \
+	__slots__ = ['filename', '_nameid', 'schema', 'values', '_text', \
 		'enable_sss', 'sss', 'enable_shadow', 'shadow', \
 		'_gui_default', '_gui_enable_sss', '_gui_sss', \
-		'_gui_enable_shadow', '_gui_shadow']
+		'_gui_enable_shadow', '_gui_shadow', '_gui_parameters']
 
 	def __init__(self, filename = None, nameid = None):
 
@@ -690,6 +697,7 @@ class Shader(object):
 		self._gui_sss           = None
 		self._gui_enable_shadow = None
 		self._gui_shadow        = None
+		self._gui_parameters    = None
 
 		self.setup(filename, nameid)
 
@@ -698,9 +706,11 @@ class Shader(object):
 		self.filename = filename
 		self.nameid = nameid
 
-		self.parameters = {}
-		self.type = None
-		self.name = None
+		self.schema = None
+		self.values = {}
+		self._text  = None
+
+		self._gui_parameters = None
 
 		self.__setdefault()
 
@@ -720,12 +730,10 @@ class Shader(object):
 
 		for attr_name in self.__slots__:
 
-			if (attr_name in ['_gui_default', '_gui_enable_sss', '_gui_sss', '_gui_enable_shadow', '_gui_shadow']):
+			if (attr_name in ['_gui_default', '_gui_enable_sss', '_gui_sss', '_gui_enable_shadow', '_gui_shadow', '_gui_parameters']):
 				value = None
-			elif (attr_name == 'parameters'):
-				value = {}
-				for key, data in self.parameters.iteritems():
-					value[key] = copy.deepcopy(data)
+			elif (attr_name == 'values'):
+				value = self.values.copy()
 			else:
 				value = getattr(self, attr_name)
 
@@ -733,6 +741,35 @@ class Shader(object):
 
 		return new_shader
 
+	@apply
+	def nameid():
+		def fget(self):
+			return self._nameid
+
+		def fset(self, value):
+			self._nameid = value
+			self._text   = None
+
+		return property(**locals())
+
+	@property
+	def type(self):
+		if (self.schema is None):
+			return None
+		return self.schema.type
+
+	@property
+	def name(self):
+		if (self.schema is None):
+			return None
+		return self.schema.name
+
+	@property
+	def parameters(self):
+		if (self.schema is None):
+			return {}
+		return self.schema.parameters
+
 	def __len__(self):
 		return len(self.parameters)
 
@@ -740,30 +777,59 @@ class Shader(object):
 		return enumerate(self.parameters.iterkeys())
 
 	def __getitem__(self, key):
-		return self.parameters[key].val
+		value = self.values.get(key)
+		if (value is None):
+			return self.parameters[key].default
+		return value
 
 	def __setitem__(self, key, value):
-		self.parameters[key].val = str(value)
+		if (not self.parameters.has_key(key)):
+			raise KeyError, key
 
-		if (INTERACTIVE):
+		self.values[key] = str(value)
+		self._text = None
+
+		if (INTERACTIVE and Sbase.redraw):
 			Blender.Draw.Redraw(1)
 
+	def cb_parameter(self, name, val):
+		self.values[name] = val
+		self._text = None
+
 	def __str__(self):
+
+		# cached text, or fragments with the templates of ${name} strings
+
+		text = self._text
+
+		if (text is None):
+			text = self._text = self.render()
+
+		if (isinstance(text, basestring)):
+			return text
+
+		slist = []
+		for t in text:
+			if (isinstance(t, basestring)):
+				slist.append(t)
+			else:
+				slist.append('Parameter ("string %s", "%s")\n' % (t[0], Sbase.parse_variables(t[1])))
+
+		return ''.join(slist)
+
+	def render(self):
 		if ((self.type is None) or (not self.name)):
 			if (Sbase.verbose > 1):
 				print 'Error: null shader'
 			return ''
 
-		slist = []
-		for (name, par) in self.parameters.iteritems():
-
-			# skip if no change
+		parameters = self.parameters
 
-			if (not par.change):
-				continue
+		slist = []
+		for name in sorted(self.values.iterkeys()):
 
-			ty = par.type
-			val = par.val.strip()
+			ty = parameters[name].type
+			val = self.values[name].strip()
 
 			# float
 
@@ -780,7 +846,10 @@ class Shader(object):
 
 			elif (ty is Sbase.literals.string):
 
-				slist.append('Parameter ("string %s", "%s")\n' % (name, Sbase.parse_variables(val)))
+				if (Sbase.re_variables.search(val)):
+					slist.append((name, val))
+				else:
+					slist.append('Parameter ("string %s", "%s")\n' % (name, val))
 
 			# color, point, vector, normal
 
@@ -820,13 +889,40 @@ class Shader(object):
 				print 'Error: unknow type shader "%s"' % Sbase.types[ty]
 			return ''
 
-		return ''.join(slist)
+		# join the text between the templates, always str (a nameid read from XML can be unicode)
+
+		text = []
+		for t in slist:
+			if (type(t) is unicode):
+				t = t.encode('utf-8')
+
+			if ((type(t) is str) and text and (type(text[-1]) is str)):
+				text[-1] += t
+			else:
+				text.append(t)
+
+		if (len(text) == 1):
+			return text[0]
+
+		return tuple(text)
+
+	def has_variables(self):
+		"""
+		Check if a string parameter uses ${name} variables
+		"""
+
+		parameters = self.parameters
+
+		for (name, val) in self.values.iteritems():
+			if ((parameters[name].type is Sbase.literals.string) and Sbase.re_variables.search(val)):
+				return True
+		return False
 
 	def setdefault(self):
 		self.__setdefault()
 
-		for par in self.parameters.itervalues():
-			par.setdefault()
+		self.values = {}
+		self._text  = None
 
 	def cb_button_default(self, event, val):
 		ret = Blender.Draw.PupMenu('Default values, continue ?%t|no%x1|yes%x2')
@@ -864,10 +960,25 @@ class Shader(object):
 
 		GUI_Base.line_feed()
 
+		if (self._gui_parameters is None):
+			self._gui_parameters = {}
+
 		i = 0
 		for name in sorted(self.parameters.iterkeys(), reverse=True):
 
-			self.parameters[name].draw()
+			gui = self._gui_parameters.get(name)
+
+			if (gui is None):
+				par = self.parameters[name]
+
+				help = par.type_name + ' ' + name
+				if (par.default):
+					help += ' (default: %s)' % par.default
+
+				gui = self._gui_parameters[name] = GUI_String('shader', None, name + ': ', Sbase.parameter_width, 128,
+					func = lambda event, val, name = name: self.cb_parameter(name, val), help = help)
+
+			gui.draw(self[name])
 
 			i += 1
 			if (i > 2):
@@ -899,41 +1010,76 @@ class Shader(object):
 			self._gui_shadow.draw(self.shadow)
 
 	def parse_file(self):
-		global CMD_MASK
 
-		# open file
+		if (shader_cache is None):
+			info = Shader.read_info(self.filename)
+		else:
+			info = shader_cache.info(self.filename)
+
+		if (info is None):
+			return False
+
+		# shared schema
+
+		schema = Shader.schemas.get(self.filename)
 
-		cmd = CMD_MASK % (GSOINFO, self.filename)
+		if ((schema is None) or (schema.info != info)):
+			schema = Shader.schemas[self.filename] = Shader.Schema(info)
+
+		self.schema = schema
+
+		return True
+
+	@staticmethod
+	def read_info(filename):
+		"""
+		Read type, name and parameters of a shader with gsoinfo
+		"""
+
+		cmd = [GSOINFO, filename]
 
 		try:
-			fcmd = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE).stdout
+			proc = subprocess.Popen(cmd, stdout = subprocess.PIPE)
 		except:
 			if (Sbase.verbose > 0):
 				sys.excepthook(*sys.exc_info())
-				print 'Error: command "%s"' % cmd
-			return False
+				print 'Error: command "%s"' % ' '.join(cmd)
+			return None
+
+		try:
+			return Shader.parse_info(proc.stdout)
+		finally:
+			proc.stdout.close()
+			proc.wait()
+
+	@staticmethod
+	def parse_info(lines):
+		"""
+		Parse the output of gsoinfo
+		"""
+
+		lines = iter(lines)
 
 		# read first line
 
-		line = fcmd.readline().strip()
+		try:
+			line = lines.next().strip()
+		except StopIteration:
+			return None
 
 		try:
 			(ty, name) = line.split(' ')
 		except ValueError:
-			return False
+			return None
 
 		if (not Sbase.types.has_key(ty)):
 			if (Sbase.verbose > 1):
 				print 'Error: unknow shader type "%s" name "%s"' % (ty, name)
-			return False
+			return None
 
-		# shader and name type
+		parameters = []
 
-		self.type = Sbase.types[ty]
-		self.name = name
-
-		i = 0
-		for line in fcmd:
+		for line in lines:
 			elements = line.strip().split(' ')
 
 			l = len(elements)
@@ -954,7 +1100,7 @@ class Shader(object):
 				continue
 
 			par_name = None
-			par_obj  = None
+			default  = None
 
 			lit = Sbase.literals[elements[0]]
 
@@ -962,72 +1108,59 @@ class Shader(object):
 
 			if ((lit is Sbase.literals.float) and (l >= 3)):
 				par_name = elements[1]
-				par_obj  = self.Parameter(lit, elements[2], Sbase.literals[lit], par_name)
+				default  = elements[2]
 
 			# string
 
 			elif ((lit is Sbase.literals.string) and (l >= 3)):
 				par_name = elements[1]
-				par_obj  = self.Parameter(lit, elements[2][1:-1], Sbase.literals[lit], par_name)
+				default  = elements[2][1:-1]
 
 			# color, point, vector, normal
 
 			elif ((lit in [Sbase.literals.color, Sbase.literals.point, Sbase.literals.vector, Sbase.literals.normal]) and (l >= 3)):
-				val = elements[2]
+				default = elements[2]
 				try:
 					if ((l >= 7) and (elements[2] == '[' and elements[6] == ']')):
-						val = '%s %s %s' % (elements[3], elements[4], elements[5])
+						default = '%s %s %s' % (elements[3], elements[4], elements[5])
 				except:
 					pass
 
 				par_name = elements[1]
-				par_obj  = self.Parameter(lit, val, Sbase.literals[lit], par_name)
 
 			# TODO matrix
 
-			if ((par_name is None) or (par_obj is None)):
+			if (par_name is None):
 				if (Sbase.verbose > 1):
 					print 'Error: unknow parameter "%s"' % elements
-					continue
-
-			self.parameters[par_name] = par_obj
-			i += 1
+				continue
 
-		fcmd.close()
+			parameters.append((lit, default, par_name))
 
-		return True
+		return (Sbase.types[ty], name, parameters)
 
-	def toxml(self, document, root):
+	def toxml(self, write, indent = ''):
 		if (not self.filename):
 			return False
 
+		escape    = xml.sax.saxutils.escape
+		quoteattr = xml.sax.saxutils.quoteattr
+
 		# file
 
 		(directory, filename) = os.path.split(self.filename)
 
-		el = document.createElement('file')
-		root.appendChild(el)
-		el.appendChild(document.createTextNode(filename))
-		el.setAttribute('directory', directory)
+		write('%s<file directory=%s>%s</file>\n' % (indent, quoteattr(directory), escape(filename)))
 
 		# nameid
 
 		if (self.nameid):
-			el = document.createElement('nameid')
-			root.appendChild(el)
-			el.appendChild(document.createTextNode(self.nameid))
+			write('%s<nameid>%s</nameid>\n' % (indent, escape(self.nameid)))
 
 		# shader's parameter
 
-		for name, par in self.parameters.iteritems():
-			if (not par.change):
-				continue
-
-			el = document.createElement('parameter')
-			root.appendChild(el)
-			el.setAttribute('name', name)
-
-			el.appendChild(document.createTextNode(par.val))
+		for (name, val) in sorted(self.values.iteritems()):
+			write('%s<parameter name=%s>%s</parameter>\n' % (indent, quoteattr(name), escape(val)))
 
 		return True
 
@@ -1035,15 +1168,12 @@ class Shader(object):
 
 		# file
 
-		el = root.getElementsByTagName('file')
-		if (len(el) == 0):
+		dfile = root.find('file')
+		if ((dfile is None) or (not dfile.text)):
 			return False
 
-		dfile = el[0]
-		dfile.normalize()
-
-		filename = dfile.firstChild.data.strip()
-		directory = dfile.getAttribute('directory')
+		filename = dfile.text.strip()
+		directory = dfile.get('directory', '')
 		shfile =  os.path.join(directory, filename)
 
 		if (not os.path.exists(shfile)):
@@ -1053,11 +1183,7 @@ class Shader(object):
 
 		# nameid
 
-		nid = ''
-		el = root.getElementsByTagName('nameid')
-		if (len(el) > 0):
-			el[0].normalize()
-			nid = el[0].firstChild.data.strip()
+		nid = (root.findtext('nameid') or '').strip()
 
 		# re-init object
 
@@ -1068,15 +1194,131 @@ class Shader(object):
 
 		# shader's parameter
 
-		for attr in root.getElementsByTagName('parameter'):
-			name = attr.getAttribute('name')
+		for attr in root.findall('parameter'):
+			name = attr.get('name')
 			if (self.parameters.has_key(name)):
-				attr.normalize()
-				par = self.parameters[name]
-				par.val = str(attr.firstChild.data.strip())
+				self.values[name] = str((attr.text or '').strip())
+				self._text = None
 
 		return True
 
+class ShaderCache(object):
+	__slots__ = ['filename', 'entries', 'includes', 'changed']
+
+	def __init__(self, filename):
+		"""
+		Shaders signatures cached on disk, keyed by path, size and mtime,
+		and the includes of the GSL sources, keyed by path and mtime
+		"""
+
+		self.filename = filename
+		self.entries  = {}
+		self.includes = {}
+		self.changed  = False
+
+		self.load()
+
+	@staticmethod
+	def stamp(filename):
+		st = os.stat(filename)
+		return (st.st_size, st.st_mtime)
+
+	def load(self):
+		try:
+			fin = open(self.filename, 'rb')
+		except IOError:
+			return
+
+		try:
+			try:
+				(version, entries, includes) = cPickle.load(fin)
+			finally:
+				fin.close()
+		except:
+			if (Sbase.verbose > 1):
+				sys.excepthook(*sys.exc_info())
+			return
+
+		if (version == SHADER_CACHE_VERSION):
+			self.entries  = entries
+			self.includes = includes
+
+	def save(self):
+		if (not self.changed):
+			return
+
+		# forget deleted shaders
+
+		for filename in [f for f in self.entries.iterkeys() if (not os.path.exists(f))]:
+			del self.entries[filename]
+
+		# forget the includes of deleted or changed sources
+
+		for key in self.includes.keys():
+			try:
+				if (os.path.getmtime(key[0]) == key[1]):
+					continue
+			except OSError:
+				pass
+
+			del self.includes[key]
+
+		try:
+			fout = OpenTempRename(self.filename, 'wb')
+		except:
+			if (Sbase.verbose > 0):
+				print 'Error: Cannot write file "%s"' % self.filename
+			return
+
+		cPickle.dump((SHADER_CACHE_VERSION, self.entries, self.includes), fout.fd, cPickle.HIGHEST_PROTOCOL)
+
+		self.changed = False
+
+	def update(self, filenames):
+		"""
+		Read in parallel the shaders not in the cache
+		"""
+
+		missing = []
+
+		for filename in filenames:
+			try:
+				stamp = self.stamp(filename)
+			except OSError:
+				continue
+
+			entry = self.entries.get(filename)
+			if ((entry is None) or (entry[0] != stamp)):
+				missing.append((filename, stamp))
+
+		if (not missing):
+			return
+
+		infos = parallel_map(Shader.read_info, [filename for (filename, stamp) in missing])
+
+		for ((filename, stamp), info) in zip(missing, infos):
+			if (info is not None):
+				self.entries[filename] = (stamp, info)
+				self.changed = True
+
+	def info(self, filename):
+		try:
+			stamp = self.stamp(filename)
+		except OSError:
+			return None
+
+		entry = self.entries.get(filename)
+		if ((entry is not None) and (entry[0] == stamp)):
+			return entry[1]
+
+		info = Shader.read_info(filename)
+
+		if (info is not None):
+			self.entries[filename] = (stamp, info)
+			self.changed = True
+
+		return info
+
 class Gelato_pyg(object):
 
 	class name_mask(object):
@@ -1135,6 +1377,13 @@ class Gelato_pyg(object):
 			self.texco    = texco
 			self.disp     = disp
 
+	class data_motion(list):
+		__slots__ = ['times']
+
+		def __init__(self, samples, times = None):
+			list.__init__(self, samples)
+			self.times = (range(len(samples)) if (times is None) else list(times))
+
 	class data_mesh(object):
 		__slots__ = ['db_geometry', 'points', 'nverts', 'verts', 'vertexcolors', 'uvname']
 
@@ -1146,6 +1395,179 @@ class Gelato_pyg(object):
 			self.vertexcolors = []
 			self.uvname       = uvname
 
+	class data_object(object):
+		__slots__ = ['meshes', 'db_mesh', 'nfaces', 'catmull_clark', 'raster_width', 'bake_diffuse', 'enable_proxy', \
+			'single_sided', 'all_smooth']
+
+		def __init__(self, meshes, db_mesh, nfaces, catmull_clark, raster_width, bake_diffuse, enable_proxy, \
+				single_sided, all_smooth):
+			self.meshes        = meshes
+			self.db_mesh       = db_mesh
+			self.nfaces        = nfaces
+			self.catmull_clark = catmull_clark
+			self.raster_width  = raster_width
+			self.bake_diffuse  = bake_diffuse
+			self.enable_proxy  = enable_proxy
+			self.single_sided  = single_sided
+			self.all_smooth    = all_smooth
+
+	class scene_index(object):
+		__slots__ = ['viewmask', 'visible', 'properties', 'material_properties', 'lamps', \
+			'dupli_parents', 'dupli_children', 'lights', 'geometries']
+
+		def __init__(self, objects, verbose = 0):
+			"""
+			Scene classification built once per export:
+			visibility, gelato properties, lamps, dupli relationships
+			and the objects to export by type.
+			"""
+
+			self.viewmask = 0
+			for layer in Blender.Window.ViewLayers():
+				self.viewmask |= 1 << (layer - 1)
+
+			self.visible             = {}
+			self.properties          = {}
+			self.material_properties = {}
+			self.lamps               = {}
+			self.dupli_parents       = set()
+			self.dupli_children      = set()
+			self.lights              = []
+			self.geometries          = []
+
+			for mat in Blender.Material.Get():
+				self.material_properties[mat.name] = self.snapshot(mat)
+
+			dupli_candidates = []
+
+			for obj in objects:
+				name = obj.name
+
+				props = self.properties[name] = self.snapshot(obj)
+
+				visible = self.visible[name] = not ((obj.users > 1) and ((obj.Layers & self.viewmask) == 0))
+
+				if (not visible):
+					if (verbose > 1):
+						print 'Info: Object "%s" invisible' % name
+					continue
+
+				if (props.get('excluded', 0) != 0):
+					continue
+
+				try:
+					dupli = bool(obj.DupObjects)
+				except:
+					dupli = False
+
+				ty = obj.type
+
+				if (dupli):
+					self.dupli_parents.add(name)
+				elif (obj.parent is not None):
+					dupli_candidates.append(obj)
+
+				if (ty == 'Lamp'):
+					self.lamps[name] = Blender.Lamp.Get(obj.getData().name)
+
+				if (dupli or (ty == 'Lamp')):
+					self.lights.append(obj)
+
+				if (dupli or (ty in ['Mesh', 'Surf'])):
+					self.geometries.append(obj)
+
+			# children of every dupli parent, hidden and excluded too
+
+			parents = {}
+
+			for obj in dupli_candidates:
+				parent = obj.parent
+				name   = parent.name
+
+				dupli = parents.get(name)
+				if (dupli is None):
+					if (name in self.dupli_parents):
+						dupli = True
+					else:
+						try:
+							dupli = bool(parent.DupObjects)
+						except:
+							dupli = False
+
+					parents[name] = dupli
+
+				if (dupli):
+					self.dupli_children.add(obj.name)
+
+		@staticmethod
+		def snapshot(data):
+			try:
+				group = data.properties['gelato']
+			except KeyError:
+				return {}
+
+			return dict([(key, group[key]) for key in group.keys()])
+
+		def exported(self, obj):
+			"""
+			Check if object is visible and not excluded
+			"""
+
+			name = obj.name
+
+			visible = self.visible.get(name)
+			if (visible is None):
+				return ((obj.users <= 1) or ((obj.Layers & self.viewmask) != 0)) and not property_boolean_get(obj, 'excluded')
+
+			return visible and (self.properties[name].get('excluded', 0) == 0)
+
+		def lamp(self, obj):
+			lamp = self.lamps.get(obj.name)
+			if (lamp is None):
+				lamp = Blender.Lamp.Get(obj.getData().name)
+			return lamp
+
+		# gelato properties
+
+		def get(self, obj, name, default):
+			props = self.properties.get(obj.name)
+			if (props is None):
+				try:
+					return property_get(obj, name)
+				except KeyError:
+					return default
+			return props.get(name, default)
+
+		def boolean(self, obj, name, default = False):
+			value = self.get(obj, name, None)
+			if (value is None):
+				return default
+			return value != 0
+
+		def string(self, obj, name, default = ''):
+			return self.get(obj, name, default)
+
+		def number(self, obj, name, default = 0):
+			return self.get(obj, name, default)
+
+		def material_get(self, mat, name, default):
+			props = self.material_properties.get(mat.name)
+			if (props is None):
+				try:
+					return property_get(mat, name)
+				except KeyError:
+					return default
+			return props.get(name, default)
+
+		def material_boolean(self, mat, name, default = False):
+			value = self.material_get(mat, name, None)
+			if (value is None):
+				return default
+			return value != 0
+
+		def material_string(self, mat, name, default = ''):
+			return self.material_get(mat, name, default)
+
 	def __init__(self):
 		"""
 		Gelato class export.
@@ -1154,6 +1576,7 @@ class Gelato_pyg(object):
 		self.PRECISION     = 6
 		self.PRECISION_FPS = 4
 		self.EPSILON       = 1.E-7
+		self.INFINITY      = 1.E30
 		self.SCALEBIAS     = 0.1
 		self.FACTORAMBIENT = 200
 
@@ -1161,6 +1584,10 @@ class Gelato_pyg(object):
 		self.EXT_TEXTURE   = '.tx'
 		self.EXT_DIFFUSE   = '.sdb'
 		self.EXT_PHOTONMAP = '.sdb'
+		self.EXT_SNAPSHOT  = '.snap'
+
+		self.snapshot       = None
+		self.snapshot_files = []
 
 		self._SQRT2 = math.sqrt(2)
 		self._ZERO  = ctypes.c_float(0.0)
@@ -1168,6 +1595,29 @@ class Gelato_pyg(object):
 
 		self.passes = EnumType('beauty', 'shadows', 'ambient_occlusion', 'photon_map', 'bake_diffuse')
 
+		# objects classification along the frame range
+
+		self.animations = EnumType('static', 'transform', 'deform')
+
+		# modifiers that don't change over time
+
+		self.static_modifiers = frozenset([
+			Blender.Modifier.Types.SUBSURF,
+			Blender.Modifier.Types.EDGESPLIT,
+			Blender.Modifier.Types.DECIMATE,
+			Blender.Modifier.Types.SMOOTH,
+		])
+
+		# primitive variables read by the shaders of each pass (N, C, st)
+
+		self.primvars_all  = frozenset(['N', 'C', 'st'])
+		self.primvars_pass = {
+			self.passes.shadows:           frozenset(),
+			self.passes.ambient_occlusion: frozenset(['N']),
+		}
+
+		self.primvars_displacement = frozenset(['N', 'st'])
+
 		self.pbar = ProgressBar(78)
 
 		# binary header
@@ -1254,6 +1704,44 @@ class Gelato_pyg(object):
 	def file_object_name(self, name, material_index, material_max, mbur_index, mbux_max):
 		return self.generate_split_name(sanefilename(name), 'object', material_index, material_max, mbur_index, mbux_max)
 
+	def generate_cache_name(self, prefix, name = ''):
+
+		slist = [self.base]
+
+		if (self.npasses > 1):
+			slist.append('_')
+			slist.append(self.pass_name_file)
+
+		slist.append('_')
+		slist.append(prefix)
+
+		if (name):
+			slist.append('_')
+			slist.append(sanefilename(name))
+
+		slist.append(self.ext)
+
+		return ''.join(slist)
+
+	def file_static_name(self):
+		return self.generate_cache_name('static')
+
+	def file_animation_name(self, name):
+		return self.generate_cache_name('object', name)
+
+	def generate_frame_name(self, prefix, name = ''):
+		filename = self.generate_cache_name(prefix, name)
+
+		if (self.frame is None):
+			return filename
+
+		(base, ext) = os.path.splitext(filename)
+
+		return base + (self.mask % self.frame) + ext
+
+	def file_incremental_name(self, name):
+		return self.generate_frame_name('incremental', name)
+
 	def file_output_pass(self):
 		if (self.npasses <= 1):
 			if (self.current_pass == self.passes.ambient_occlusion):
@@ -1399,7 +1887,15 @@ class Gelato_pyg(object):
 
 		ty = type(array[0])
 
-		if (self.enable_binary and not ascii):
+		if ((self.snapshot is not None) and isinstance(wfile, gelatosnap.SnapshotFile)):
+
+			if (ty is int):
+				wfile.write_array('i', array, ascii)
+
+			elif (ty is float):
+				wfile.write_array('d', array, ascii)
+
+		elif (self.enable_binary and not ascii):
 
 			if (ty is int):
 
@@ -1471,6 +1967,10 @@ class Gelato_pyg(object):
 			self.file.write('Attribute ("int ray:motion", %d)\n' %
 				self.ray_motion)
 
+		if (not self.ray_traced_selective):
+			self.write_ray_traced_sets()
+
+	def write_ray_traced_sets(self):
 		self.file.write('Attribute ("string geometryset", "+reflection")\n')
 		self.file.write('Attribute ("string geometryset", "+refraction")\n')
 
@@ -1930,12 +2430,12 @@ class Gelato_pyg(object):
 			self.title,
 			cname))
 
-	def write_motion(self, n):
-		if (n < 2):
+	def write_motion(self, samples):
+		if (len(samples) < 2):
 			return
 
 		self.file.write('Motion ')
-		self.write_array(self.file, range(n), '', True)
+		self.write_array(self.file, samples.times, '', True)
 		self.file.write('\n')
 
 	def write_script(self, name):
@@ -1952,6 +2452,8 @@ class Gelato_pyg(object):
 		if ((txt is None) or (txt.nlines < 1)):
 			return
 
+		# inline: Input of a file would run the script in another namespace
+
 		self.file.write('## Script start: "%s"\n' % name)
 
 		for line in txt.asLines():
@@ -1961,13 +2463,112 @@ class Gelato_pyg(object):
 
 		self.file.write('## Script end: "%s"\n' % name)
 
-	def generate_camera_shadows(self, obj, matrices):
-
+	def open_output(self, filename):
+		"""
+		Open an output file, in the snapshot if enabled
+		"""
+
+		if (self.snapshot is not None):
+			return self.snapshot.open(filename)
+
+		return open(filename, 'wb')
+
+	def write_include(self, filename, fc, *args):
+		"""
+		Write a frame independent file once and include it
+		"""
+
+		if (filename not in self.include_memo):
+
+			try:
+				finclude = self.open_output(filename)
+			except IOError:
+				raise GelatoError, 'Cannot write file "%s"' % filename
+
+			if (self.verbose > 1):
+				print 'Info: exporting include file "%s"' % filename
+
+			fout = self.file
+			self.file = finclude
+
+			try:
+				fc(*args)
+			finally:
+				self.file = fout
+				finclude.close()
+
+			self.include_memo.add(filename)
+
+		self.file.write('Input ("%s")\n' % fix_file_name(filename))
+
+	def hashed_write(self, filename, data):
+		"""
+		Write a file named by its hash, the name on disk
+		is always a complete file
+		"""
+
+		if (self.snapshot is not None):
+			fout = self.snapshot.open(filename)
+			fout.write(data)
+			fout.close()
+
+		elif (not os.path.exists(filename)):
+			try:
+				fout = OpenTempRename(filename, 'wb')
+			except:
+				raise GelatoError, 'Cannot write file "%s"' % filename
+
+			fout.fd.write(data)
+
+			del fout
+
+	def store_write(self, data):
+		"""
+		Write the geometry once in the store, the name is its hash
+		"""
+
+		digest = hashlib.sha1(data).hexdigest()
+
+		filename = os.path.join(self.store_directory, digest + self.ext)
+
+		if (digest not in self.store_memo):
+
+			if (self.snapshot is not None):
+				fout = self.snapshot.open(filename)
+				fout.write(data)
+				fout.close()
+
+			elif (not os.path.exists(filename)):
+				try:
+					fout = OpenTempRename(filename, 'wb')
+				except:
+					raise GelatoError, 'Cannot write file "%s"' % filename
+
+				fout.fd.write(data)
+
+				del fout
+
+				if (self.verbose > 1):
+					print 'Info: exporting store file "%s"' % filename
+
+			self.store_memo.add(digest)
+
+		return fix_file_name(filename)
+
+	def light_culled(self, name):
+		return ((self.instance is None) and (name in self.culled_lights))
+
+	def generate_camera_shadows(self, obj, matrices):
+
 		if (obj.type != 'Lamp'):
 			return
 
 		name = obj.name
-		lamp = Blender.Lamp.Get(obj.getData().name)
+
+		if (self.light_culled(name)):
+			return
+
+		lamp = self.index.lamp(obj)
 
 		lname = lamp.name
 		ltype = lamp.type
@@ -1993,13 +2594,13 @@ class Gelato_pyg(object):
 		if (obj.type != 'Lamp'):
 			return
 
-		photon_map = property_boolean_get(obj, 'photon_map')
+		photon_map = self.index.boolean(obj, 'photon_map')
 
 		if (not photon_map):
 			return
 
 		name = obj.name
-		lamp = Blender.Lamp.Get(obj.getData().name)
+		lamp = self.index.lamp(obj)
 
 		lname = lamp.name
 		ltype = lamp.type
@@ -2020,7 +2621,13 @@ class Gelato_pyg(object):
 			return
 
 		name = obj.name
-		lamp = Blender.Lamp.Get(obj.getData().name)
+
+		if (self.light_culled(name)):
+			if (self.verbose > 0):
+				self.file.write('\n## Culled light: "%s"\n' % name)
+			return
+
+		lamp = self.index.lamp(obj)
 
 		lname = lamp.name
 		ltype = lamp.type
@@ -2034,16 +2641,16 @@ class Gelato_pyg(object):
 
 		# prescript
 
-		if (self.enable_scripts and property_boolean_get(obj, 'enable_prescript')):
-			prescript = property_string_get(obj, 'prescript')
+		if (self.enable_scripts and self.index.boolean(obj, 'enable_prescript')):
+			prescript = self.index.string(obj, 'prescript')
 			if (prescript):
 				self.write_script(prescript)
 
 		# script
 
-		if (self.enable_scripts and property_boolean_get(obj, 'enable_script')):
+		if (self.enable_scripts and self.index.boolean(obj, 'enable_script')):
 
-			script = property_string_get(obj, 'script')
+			script = self.index.string(obj, 'script')
 			if (script):
 				self.write_script(script)
 
@@ -2080,8 +2687,8 @@ class Gelato_pyg(object):
 
 		# postscript
 
-		if (self.enable_scripts and property_boolean_get(obj, 'enable_postscript')):
-			postscript = property_string_get(obj, 'postscript')
+		if (self.enable_scripts and self.index.boolean(obj, 'enable_postscript')):
+			postscript = self.index.string(obj, 'postscript')
 			if (postscript):
 				self.write_script(postscript)
 
@@ -2089,14 +2696,14 @@ class Gelato_pyg(object):
 
 	def write_geometry_head(self, obj, matrices):
 
-		indirect_light = property_boolean_get(obj, 'indirect_light', True)
+		indirect_light = self.index.boolean(obj, 'indirect_light', True)
 
 		self.file.write('\nPushAttributes ()\n')
 
 		# prescript
 
-		if (self.enable_scripts and property_boolean_get(obj, 'enable_prescript')):
-			prescript = property_string_get(obj, 'prescript')
+		if (self.enable_scripts and self.index.boolean(obj, 'enable_prescript')):
+			prescript = self.index.string(obj, 'prescript')
 			if (prescript):
 				self.write_script(prescript)
 
@@ -2106,7 +2713,14 @@ class Gelato_pyg(object):
 		if (not indirect_light):
 			self.file.write('Attribute ("string geometryset", "-indirect")\n')
 
-		self.write_motion(len(matrices))
+		# selective ray traced
+
+		if ((self.ray_traced_objects is not None) and (self.current_pass != self.passes.photon_map)):
+			if ((obj.name in self.ray_traced_objects) or
+				((self.instance is not None) and self.ray_traced_objects and self.index.boolean(obj, 'ray_traced', True))):
+					self.write_ray_traced_sets()
+
+		self.write_motion(matrices)
 
 		for m in matrices:
 			self.write_set_transform(m)
@@ -2115,8 +2729,8 @@ class Gelato_pyg(object):
 
 		# postscript
 
-		if (self.enable_scripts and property_boolean_get(obj, 'enable_postscript')):
-			postscript = property_string_get(obj, 'postscript')
+		if (self.enable_scripts and self.index.boolean(obj, 'enable_postscript')):
+			postscript = self.index.string(obj, 'postscript')
 			if (postscript):
 				self.write_script(postscript)
 
@@ -2127,6 +2741,81 @@ class Gelato_pyg(object):
 		if (material is None):
 			return
 
+		self.file.write('PushAttributes ()\n')
+
+		# cached text of the material, None is the object's sss shader
+
+		key = (material.name, self.current_pass, bake_diffuse)
+
+		fragments = self.material_memo.get(key)
+
+		if (fragments is None):
+			fout = self.file
+			self.file = cStringIO.StringIO()
+			self.material_fragments = fragments = []
+
+			try:
+				self.material_head(material, bake_diffuse)
+				fragments.append(self.file.getvalue())
+			finally:
+				self.file = fout
+				self.material_fragments = None
+
+			self.material_memo[key] = fragments
+
+		# material include, named by the hash of its text
+
+		if (self.enable_material_library and (None not in fragments) and self.material_shared(material)):
+			self.file.write('Input ("%s")\n' % fix_file_name(self.write_material_include(key, fragments)))
+			return
+
+		for text in fragments:
+			if (text is None):
+				self.write_material_sss(name, material)
+			else:
+				self.file.write(text)
+
+	def material_shared(self, material):
+		"""
+		Check if the material can be written in an include file
+		"""
+
+		if (self.enable_scripts):
+			for script in ['enable_prescript', 'enable_script', 'enable_postscript']:
+				if (self.index.material_boolean(material, script)):
+					return False
+
+		return True
+
+	def write_material_include(self, key, fragments):
+		"""
+		Write the material text once in a file named by its hash
+		"""
+
+		filename = self.material_files.get(key)
+
+		if (filename is None):
+			data = ''.join(fragments)
+
+			filename = self.material_files[key] = '%s_material_%s%s' % (self.base, hashlib.sha1(data).hexdigest(), self.ext)
+
+			self.hashed_write(filename, '## Material: "%s"\n' % key[0] + data)
+
+		return filename
+
+	def write_material_sss(self, name, material):
+		sd = gelato_gui.assigned_material[1].get(material.name)
+
+		nsd = copy.deepcopy(sd)
+		nsd[sd.sss] = self.file_diffuse_name(name)
+
+		self.file.write(str(nsd))
+
+	def material_head(self, material, bake_diffuse):
+		"""
+		Write the attributes and shaders of the material
+		"""
+
 		mat_name = material.name
 		flags = material.mode
 		enabled_textures = material.enabledTextures
@@ -2201,12 +2890,10 @@ class Gelato_pyg(object):
 							mtex.texco,
 							mtex.mtDisp * mtex.dispfac))
 
-		self.file.write('PushAttributes ()\n')
-
 		# prescript
 
-		if (self.enable_scripts and property_boolean_get(material, 'enable_prescript')):
-			prescript = property_string_get(material, 'prescript')
+		if (self.enable_scripts and self.index.material_boolean(material, 'enable_prescript')):
+			prescript = self.index.material_string(material, 'prescript')
 			if (prescript):
 				self.write_script(prescript)
 
@@ -2214,8 +2901,8 @@ class Gelato_pyg(object):
 
 			# script
 
-			if (self.enable_scripts and property_boolean_get(material, 'enable_script')):
-				script = property_string_get(material, 'script')
+			if (self.enable_scripts and self.index.material_boolean(material, 'enable_script')):
+				script = self.index.material_string(material, 'script')
 				if (script):
 					self.write_script(script)
 				return
@@ -2269,11 +2956,12 @@ class Gelato_pyg(object):
 						self.file.write('Shader ("surface", "plastic")\n')
 					else:
 						if (bake_diffuse and self.enable_bake_diffuse and sd.enable_sss and (self.current_pass == self.passes.beauty)):
-							nsd = copy.deepcopy(sd)
-							nsd[sd.sss] = self.file_diffuse_name(name)
-							sd = nsd
-
-						self.file.write(str(sd))
+							# object's sss shader
+							self.material_fragments.append(self.file.getvalue())
+							self.material_fragments.append(None)
+							self.file = cStringIO.StringIO()
+						else:
+							self.file.write(str(sd))
 
 			if (enable_shadergroup):
 				self.file.write('ShaderGroupEnd ()\n')
@@ -2281,8 +2969,19 @@ class Gelato_pyg(object):
 		if (self.enable_displacements):
 
 			sd = gelato_gui.assigned_displacement[1].get(mat_name)
+
+			# displacement bound
+
+			self.file.write('Attribute ("float displace:maxradius", %s)\n' %
+				round(self.displacement_bound(material, sd, textures_displacement), self.PRECISION))
+
 			if (sd is None):
 
+				# the dispmap bound is in the units of the object
+
+				if (textures_displacement):
+					self.file.write('Attribute ("string displace:maxspace", "shader")\n')
+
 				# texture displacement
 
 				esg = len(textures_displacement) > 1
@@ -2357,6 +3056,35 @@ class Gelato_pyg(object):
 		if (flags & Blender.Material.Modes.TRANSPSHADOW):
 			self.file.write('Attribute ("int ray:opaqueshadows", 0)\n')
 
+	def displacement_bound(self, material, sd, textures_displacement):
+		"""
+		Maximum radial displacement of the material
+		"""
+
+		# shader displacement
+
+		if (sd is not None):
+			try:
+				maxradius = float(self.index.material_get(material, 'maxradius', 0.0))
+			except (ValueError, TypeError):
+				maxradius = 0.0
+
+			if (maxradius > 0.0):
+				return maxradius
+
+			try:
+				return float(self.maxradius)
+			except ValueError:
+				return 0.0
+
+		# texture displacement (dispmap: Km * texture value in [0, 1])
+
+		bound = 0.0
+		for ftex in textures_displacement:
+			bound += abs(ftex.disp)
+
+		return bound
+
 	def write_material_tail(self, material):
 		if (material is None):
 			return
@@ -2369,229 +3097,735 @@ class Gelato_pyg(object):
 
 		# postscript
 
-		if (self.enable_scripts and property_boolean_get(material, 'enable_postscript')):
-			postscript = property_string_get(material, 'postscript')
+		if (self.enable_scripts and self.index.material_boolean(material, 'enable_postscript')):
+			postscript = self.index.material_string(material, 'postscript')
 			if (postscript):
 				self.write_script(postscript)
 
-	def process_obj_transformation(self, obj, mblur, dup = False):
-
-		motionblur_transformation = property_boolean_get(obj, 'motionblur_transformation', True)
+	@staticmethod
+	def transform_point(matrix, p):
+		"""
+		Transform a local point (row vector) by a 4x4 matrix
+		"""
 
-		if (not ((self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion]) and (mblur and motionblur_transformation))):
+		return (
+			p[0] * matrix[0][0] + p[1] * matrix[1][0] + p[2] * matrix[2][0] + matrix[3][0],
+			p[0] * matrix[0][1] + p[1] * matrix[1][1] + p[2] * matrix[2][1] + matrix[3][1],
+			p[0] * matrix[0][2] + p[1] * matrix[1][2] + p[2] * matrix[2][2] + matrix[3][2])
 
-			return [obj.matrix]
+	@staticmethod
+	def matrix_scale(matrix):
+		"""
+		Maximum scale factor of the axes of a 4x4 matrix
+		"""
 
-		else:
-			# get current frame number
+		return max([math.sqrt(matrix[i][0] ** 2 + matrix[i][1] ** 2 + matrix[i][2] ** 2) for i in xrange(3)])
 
-			curframe = Blender.Get('curframe')
+	def screen_scale(self, point):
+		"""
+		Pixels per unit length at a world point
+		"""
 
-			try:
-				matrixs = []
+		if (self.screen is None):
+			return 1.0
 
-				for i in xrange(self.frames_transformation - 1, -1, -1):
+		(position, direction, near, factor, perspective) = self.screen
 
-					f = curframe - i
-					if (f < 1):
-						f = 1
+		if (not perspective):
+			return factor
 
-					Blender.Set('curframe', f)
+		depth = ((point[0] - position[0]) * direction[0] +
+			(point[1] - position[1]) * direction[1] +
+			(point[2] - position[2]) * direction[2])
 
-					if (dup):
-						dup_matrixs = []
-						for dobj, mat in obj.DupObjects:
-							dup_matrixs.append(mat.copy())
+		return factor / max(depth, near)
 
-						matrixs.append(dup_matrixs)
-					else:
-						matrixs.append(obj.matrix.copy())
+	def transformation_error(self, probes):
+		"""
+		Screen error of the linear interpolation of two matrices
+		"""
 
-				return matrixs
+		def error(ma, mb, mm, t):
+			s = 1.0 - t
+			ml = [[ma[i][j] * s + mb[i][j] * t for j in xrange(4)] for i in xrange(4)]
 
-			finally:
-				# restore frame number
+			err = 0.0
+			for p in probes:
+				wm = self.transform_point(mm, p)
+				wl = self.transform_point(ml, p)
 
-				Blender.Set('curframe', curframe)
+				d = math.sqrt((wm[0] - wl[0]) ** 2 + (wm[1] - wl[1]) ** 2 + (wm[2] - wl[2]) ** 2)
 
-	def process_mesh_deformation(self, obj):
+				err = max(err, d * self.screen_scale(wm))
 
-		# motion blur deformation
+			return err
 
-		motionblur_deformation = property_boolean_get(obj, 'motionblur_deformation')
+		return error
 
-		if  (not ((self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion]) and  self.enable_motion_blur and  motionblur_deformation)):
+	def deformation_error(self, obj):
+		"""
+		Screen error of the linear interpolation of two meshes
+		"""
 
-			mesh = Blender.Mesh.New()
-			mesh.getFromObject(obj, 0, 1)
+		matrix = obj.matrix
+		scale  = self.matrix_scale(matrix) * self.screen_scale((matrix[3][0], matrix[3][1], matrix[3][2]))
 
-			return [mesh]
-		else:
-			# get current frame number
+		def error(ma, mb, mm, t):
+			(ca, cb, cm) = (ma[1], mb[1], mm[1])
 
-			curframe = Blender.Get('curframe')
+			if ((len(ca) != len(cm)) or (len(cb) != len(cm))):
+				return self.INFINITY
 
-			try:
-				meshes = []
+			s = 1.0 - t
 
-				for i in xrange(self.frames_deformation - 1, -1, -1):
+			dmax = 0.0
+			for (a, b, m) in zip(ca, cb, cm):
+				d = ((m[0] - a[0] * s - b[0] * t) ** 2 +
+					(m[1] - a[1] * s - b[1] * t) ** 2 +
+					(m[2] - a[2] * s - b[2] * t) ** 2)
 
-					f = curframe - i
-					if (f < 1):
-						f = 1
+				if (d > dmax):
+					dmax = d
 
-					Blender.Set('curframe', f)
+			return math.sqrt(dmax) * scale
 
-					mesh = Blender.Mesh.New()
-					mesh.getFromObject(obj, 0, 1)
+		return error
 
-					meshes.append(mesh)
+	def motion_samples(self, obj, n, sample, error = None):
+		"""
+		Sample the motion of the object over n frames.
+		The number of samples is the per-object override, or with the adaptive
+		motion blur the smallest that keeps the screen error under the limit.
+		"""
 
-				return meshes
+		last = n - 1
 
-			finally:
-				# restore frame number
+		# per-object override
 
-				Blender.Set('curframe', curframe)
+		override = int(self.index.number(obj, 'motion_samples'))
 
-	def generate_mesh(self, obj, matrices):
+		if (override > 0):
+			k = min(override, n)
+			if (k == 1):
+				indices = [last]
+			else:
+				indices = sorted(set([int(round(i * last / float(k - 1))) for i in xrange(k)]))
 
-		if (obj.type not in ['Mesh', 'Surf']):
-			return
+			return self.data_motion([sample(i) for i in indices], indices)
 
-		name = obj.name
+		if ((error is None) or (not self.enable_adaptive_motion) or (n < 2)):
+			return self.data_motion([sample(i) for i in xrange(n)])
 
-		# get meshes
+		# adaptive
 
-		try:
-			meshes = self.process_mesh_deformation(obj)
-		except:
-			if (self.verbose > 0):
-				sys.excepthook(*sys.exc_info())
-			return
+		memo = {}
+		def get(i):
+			if (not memo.has_key(i)):
+				memo[i] = sample(i)
+			return memo[i]
 
-		nmeshes = len(meshes)
-		if (nmeshes < 1):
-			return
+		tolerance = self.motion_error
 
-		nfaces = len(meshes[0].faces)
-		if (nfaces < 1):
-			return
+		# static
 
-		# get properties
+		first  = get(0)
+		middle = get(last / 2)
+		end    = get(last)
 
-		catmull_clark = property_boolean_get(obj, 'catmull_clark')
-		raster_width  = property_boolean_get(obj, 'raster_width')
-		bake_diffuse  = property_boolean_get(obj, 'bake_diffuse')
-		enable_proxy  = property_boolean_get(obj, 'enable_proxy')
+		if ((error(end, end, first, 0.0) <= tolerance) and (error(end, end, middle, 0.0) <= tolerance)):
+			return self.data_motion([end], [last])
 
-		# interpolation type
+		# bisection
 
-		interpolation = ('catmull-clark' if (catmull_clark) else 'linear')
+		indices = set([0, last])
+		stack   = [(0, last)]
 
-		# single sided face
+		while (stack):
+			(a, b) = stack.pop()
+			if ((b - a) < 2):
+				continue
 
-		single_sided = not (self.enable_double_sided or (meshes[0].mode & Blender.Mesh.Modes.TWOSIDED))
+			m = (a + b) / 2
+			if (error(get(a), get(b), get(m), float(m - a) / (b - a)) > tolerance):
+				indices.add(m)
+				stack.extend([(a, m), (m, b)])
 
-		# if NURBS smooth surfaces
+		indices = sorted(indices)
 
-		all_smooth = (obj.type == 'Surf')
+		if (self.verbose > 1):
+			print 'Info: object "%s" motion samples %d/%d' % (obj.name, len(indices), n)
 
-		# vertex color
+		return self.data_motion([get(i) for i in indices], indices)
 
-		vtcolor = meshes[0].vertexColors
+	def matrices_equal(self, a, b):
+		for i in xrange(4):
+			for j in xrange(4):
+				if (abs(a[i][j] - b[i][j]) >= self.EPSILON):
+					return False
+		return True
 
-		# UV map
+	def matrices_list_equal(self, a, b):
+		if (len(a) != len(b)):
+			return False
 
-		faceuv = (self.enable_uv and meshes[0].faceUV)
+		for (ma, mb) in zip(a, b):
+			if (not self.matrices_equal(ma, mb)):
+				return False
+		return True
 
-		# loop meshes
+	def meshes_equal(self, a, b):
+		(ma, ca) = a
+		(mb, cb) = b
 
-		db_mesh = []
+		if ((len(ca) != len(cb)) or (len(ma.faces) != len(mb.faces))):
+			return False
 
-		for mesh in meshes:
+		eps = self.EPSILON
 
-			if (vtcolor):
-				nlist_col = range(len(mesh.verts))
+		for (va, vb) in zip(ca, cb):
+			if ((abs(va[0] - vb[0]) >= eps) or (abs(va[1] - vb[1]) >= eps) or (abs(va[2] - vb[2]) >= eps)):
+				return False
+		return True
 
-			# new mesh
+	def collapse_motion(self, samples, equal):
+		"""
+		Collapse identical samples (within EPSILON) to a single static sample
+		"""
 
-			dmesh = self.data_mesh(mesh.renderUVLayer)
-			db_mesh.append(dmesh)
+		if (len(samples) < 2):
+			return samples
 
-			db_geometry = dmesh.db_geometry
+		last = samples[-1]
 
-			# loop faces
+		for sample in samples[:-1]:
+			if (not equal(sample, last)):
+				return samples
 
-			for index_face, face in enumerate(mesh.faces):
+		if (self.verbose > 1):
+			print 'Info: collapsed %d motion samples' % len(samples)
 
-				fsmooth = face.smooth
-				nverts  = len(face.verts)
+		return self.data_motion([last], samples.times[-1:])
 
-				# new geometry
+	def object_probes(self, obj):
+		"""
+		Local points used to measure the motion of the object
+		"""
 
-				dgeometry = db_geometry.setdefault(face.mat, self.data_geometry())
+		try:
+			bbox = obj.getBoundBox(0)
+		except:
+			bbox = None
 
-				if (fsmooth):
-					dgeometry.smooth = True
+		if (not bbox):
+			return [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0)]
 
-				dgeometry.index_faces.append(index_face)
+		return [(v[0], v[1], v[2]) for v in bbox]
 
-				if (catmull_clark):
-					dmesh.nverts.append(nverts)
-				else:
-					dgeometry.nverts.append(nverts)
+	def process_obj_transformation(self, obj, mblur, dup = False):
 
-				# loop vertexes
+		motionblur_transformation = self.index.boolean(obj, 'motionblur_transformation', True)
 
-				if (catmull_clark):
+		if (not ((self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion]) and (mblur and motionblur_transformation))):
 
-					for v in face.verts:
+			return self.data_motion([obj.matrix])
 
-						# vertexes index
+		else:
+			# get current frame number
 
-						dmesh.verts.append(v.index)
-				else:
+			curframe = Blender.Get('curframe')
 
-					for v in face.verts:
+			n = self.frames_transformation
 
-						# vertexes index
+			def sample(i):
+				f = curframe - (n - 1 - i)
+				if (f < 1):
+					f = 1
 
-						dgeometry.verts.append(v.index)
+				Blender.Set('curframe', f)
 
-						# normals
+				if (dup):
+					dup_matrixs = []
+					for dobj, mat in obj.DupObjects:
+						dup_matrixs.append(mat.copy())
 
-						no = (v.no if (all_smooth or fsmooth) else face.no)
+					return dup_matrixs
 
-						dgeometry.normals.extend([no[0], no[1], no[2]])
+				return obj.matrix.copy()
 
-				if (vtcolor):
-					for j in xrange(len(face.verts)):
-						c = face.col[j]
-						nlist_col[face.verts[j].index] = [c.r, c.g, c.b]
+			try:
+				if (dup):
+					return self.collapse_motion(self.motion_samples(obj, n, sample), self.matrices_list_equal)
 
-			# loop vertexes
+				samples = self.motion_samples(obj, n, sample, self.transformation_error(self.object_probes(obj)))
 
-			for v in mesh.verts:
+				return self.collapse_motion(samples, self.matrices_equal)
 
-				# points
+			finally:
+				# restore frame number
 
-				dmesh.points.extend([v.co.x, v.co.y, v.co.z])
+				Blender.Set('curframe', curframe)
 
-			# vertex color
+	def process_mesh_deformation(self, obj):
 
-			if (vtcolor):
-				for c in nlist_col:
-					try:
-						dmesh.vertexcolors.extend([c[0]/255.0, c[1]/255.0, c[2]/255.0])
-					except:
-						dmesh.vertexcolors.extend(self._ZERO3)
+		# motion blur deformation
 
-			# UV layers
+		motionblur_deformation = self.index.boolean(obj, 'motionblur_deformation')
 
-			if (faceuv):
+		if  (not ((self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion]) and  self.enable_motion_blur and  motionblur_deformation)):
 
-				# save UV layer name
+			mesh = Blender.Mesh.New()
+			mesh.getFromObject(obj, 0, 1)
+
+			return self.data_motion([mesh])
+		else:
+			# get current frame number
+
+			curframe = Blender.Get('curframe')
+
+			n = self.frames_deformation
+
+			def sample(i):
+				f = curframe - (n - 1 - i)
+				if (f < 1):
+					f = 1
+
+				Blender.Set('curframe', f)
+
+				mesh = Blender.Mesh.New()
+				mesh.getFromObject(obj, 0, 1)
+
+				return (mesh, [(v.co[0], v.co[1], v.co[2]) for v in mesh.verts])
+
+			try:
+				samples = self.motion_samples(obj, n, sample, self.deformation_error(obj))
+				samples = self.collapse_motion(samples, self.meshes_equal)
+
+				return self.data_motion([mesh for (mesh, coords) in samples], samples.times)
+
+			finally:
+				# restore frame number
+
+				Blender.Set('curframe', curframe)
+
+	def material_displaced(self, material):
+		"""
+		Check if the material has a displacement shader or texture
+		"""
+
+		if (material is None):
+			return False
+
+		if (gelato_gui.assigned_displacement[1].get(material.name) is not None):
+			return True
+
+		enabled_textures = material.enabledTextures
+
+		for (idx, mtex) in enumerate(material.getTextures() or []):
+
+			if ((idx not in enabled_textures) or (not mtex) or (not mtex.tex)):
+				continue
+
+			if ((mtex.mapto & Blender.Texture.MapTo.DISP) and (mtex.tex.type == Blender.Texture.Types.IMAGE)):
+				image = mtex.tex.getImage()
+				if (image and (image.source != Blender.Image.Sources.GENERATED)):
+					return True
+
+		return False
+
+	def pass_primvars(self, obj, mesh):
+		"""
+		Primitive variables to export for the current pass
+		"""
+
+		if (self.index.boolean(obj, 'all_primvars')):
+			return self.primvars_all
+
+		if (self.enable_scripts and (self.index.boolean(obj, 'enable_prescript') or self.index.boolean(obj, 'enable_postscript'))):
+			return self.primvars_all
+
+		primvars = self.primvars_pass.get(self.current_pass, self.primvars_all)
+
+		# displacements read st and N in every pass, the silhouettes must match
+
+		if (self.enable_displacements and (primvars != self.primvars_all)):
+
+			for (idx, mat) in enumerate(mesh.materials):
+				if (obj.colbits & (1 << idx)):
+					try:
+						mat = obj.getMaterials()[idx]
+					except:
+						mat = None
+
+				if (self.material_displaced(mat)):
+					return primvars | self.primvars_displacement
+
+		return primvars
+
+	def generate_mesh(self, obj, matrices):
+
+		if (obj.type not in ['Mesh', 'Surf']):
+			return
+
+		# transform-only object in animation: the mesh is written once
+
+		include = None
+
+		if ((self.animation_classes is not None) and (self.instance is None) and
+			(self.animation_class(obj) == self.animations.transform)):
+
+			include = self.file_animation_name(obj.name)
+
+			if (include in self.include_memo):
+				self.write_geometry_head(obj, matrices)
+				self.file.write('Input ("%s")\n' % fix_file_name(include))
+				self.write_geometry_tail(obj)
+				return
+
+		# incremental export: unchanged objects reuse their file
+
+		if ((include is None) and (self.incremental is not None) and self.incremental_object(obj)):
+
+			signature = self.object_signature(obj, matrices)
+
+			if (signature is not None):
+
+				filename = self.file_incremental_name(obj.name)
+
+				self.incremental_signatures[filename] = signature
+
+				if ((self.snapshot is None) and (self.incremental.get(filename) == signature) and os.path.exists(filename)):
+					self.include_memo.add(filename)
+
+					if (self.verbose > 1):
+						print 'Info: object "%s" unchanged' % obj.name
+
+				self.write_include(filename, self.write_object, obj, matrices)
+				return
+
+		self.write_object(obj, matrices, include)
+
+	def write_object(self, obj, matrices, include = None):
+
+		dobj = self.extract_mesh(obj)
+		if (dobj is None):
+			return
+
+		self.write_geometry_head(obj, matrices)
+
+		if (include is None):
+			self.write_mesh(obj, dobj)
+		else:
+			self.write_include(include, self.write_mesh, obj, dobj)
+
+		self.write_geometry_tail(obj)
+
+	def incremental_object(self, obj):
+		"""
+		Check if the object can be written in incremental mode
+		"""
+
+		if (self.instance is not None):
+			return False
+
+		if (self.enable_motion_blur and (self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion])):
+			if (self.index.boolean(obj, 'motionblur_transformation', True) or self.index.boolean(obj, 'motionblur_deformation')):
+				return False
+
+		return True
+
+	def material_signature(self, mat):
+		if (mat is None):
+			return None
+
+		name = mat.name
+
+		signature = self.material_signatures.get(name)
+		if (signature is not None):
+			return signature
+
+		textures = []
+		for mtex in mat.getTextures():
+			if ((not mtex) or (not mtex.tex)):
+				textures.append(None)
+				continue
+
+			image = None
+			if (mtex.tex.type is Blender.Texture.Types.IMAGE):
+				img = mtex.tex.getImage()
+				if (img):
+					image = img.getFilename()
+
+			textures.append((mtex.tex.name, image, mtex.texco, mtex.mapto, mtex.mapping, mtex.tex.extend,
+				mtex.mtDisp, mtex.dispfac, mtex.uvlayer))
+
+		signature = repr((name, mat.mode, tuple(mat.rgbCol), tuple(mat.specCol), mat.alpha, mat.ref, mat.spec,
+			mat.hard, mat.emit, mat.IOR, mat.rayMirr, mat.enabledTextures, tuple(textures),
+			sorted(self.index.material_properties.get(name, {}).items()),
+			str(gelato_gui.assigned_material[1].get(name, '')),
+			str(gelato_gui.assigned_displacement[1].get(name, ''))))
+
+		self.material_signatures[name] = signature
+
+		return signature
+
+	def object_signature(self, obj, matrices):
+		"""
+		Cheap signature of what is exported for the object: matrices,
+		counts, bounds, layers and modifiers of the mesh, materials,
+		gelato properties and the scene state written in its file.
+		None if the object must be written.
+		"""
+
+		try:
+			# scripts and unpacked textures change outside the signature
+
+			materials = obj.getMaterials()
+
+			mesh = obj.getData(mesh = (obj.type == 'Mesh'))
+
+			materials.extend(mesh.materials)
+
+			for mat in materials:
+				if ((mat is not None) and not self.material_reusable(mat)):
+					return None
+
+			if (self.enable_scripts and (self.index.boolean(obj, 'enable_prescript') or self.index.boolean(obj, 'enable_postscript'))):
+				return None
+
+			# mesh state without evaluating the mesh
+
+			if (obj.type == 'Mesh'):
+				state = (len(mesh.verts), len(mesh.edges), len(mesh.faces), mesh.mode, mesh.faceUV, mesh.vertexColors,
+					tuple(mesh.getUVLayerNames()), mesh.renderUVLayer, tuple(mesh.getColorLayerNames()))
+			else:
+				state = ()
+
+			bounds = [tuple(v) for v in obj.getBoundBox()]
+
+			modifiers = [(mod.name, mod.type) for mod in obj.modifiers]
+
+			# scene state
+
+			ray_traced = ((self.ray_traced_objects is not None) and (obj.name in self.ray_traced_objects))
+
+			signature = repr((self.config_signature, self.current_pass, self.verbose, obj.name, obj.type,
+				[[tuple(row) for row in m] for m in matrices], matrices.times,
+				obj.getData(name_only = True), obj.colbits, state, bounds, modifiers,
+				[self.material_signature(mat) for mat in materials],
+				sorted(self.index.properties.get(obj.name, {}).items()),
+				ray_traced))
+
+			return hashlib.sha1(signature).hexdigest()
+		except:
+			if (self.verbose > 1):
+				sys.excepthook(*sys.exc_info())
+
+		return None
+
+	def material_reusable(self, mat):
+		"""
+		Check if the file of the material can be reused:
+		no scripts and no textures unpacked at each export
+		"""
+
+		if (self.enable_scripts and (self.index.material_boolean(mat, 'enable_prescript') or
+			self.index.material_boolean(mat, 'enable_script') or self.index.material_boolean(mat, 'enable_postscript'))):
+				return False
+
+		if (self.enable_autounpack):
+			for mtex in mat.getTextures():
+				if (mtex and mtex.tex and (mtex.tex.type == Blender.Texture.Types.IMAGE)):
+					image = mtex.tex.getImage()
+					if (image and image.packed):
+						return False
+
+		return True
+
+	def build_config_signature(self):
+		"""
+		Signature of the configuration values
+		"""
+
+		values = []
+		for g in GUI_Base.registry(['config', 'local']):
+			if ((g.name is None) or (not isinstance(g.val, (int, long, float, basestring)))):
+				continue
+			values.append((g.name, g.val))
+
+		values.sort()
+
+		return hashlib.sha1(repr((__version__, values))).hexdigest()
+
+	def incremental_load(self):
+		try:
+			fin = open(self.filename_incremental, 'rb')
+		except IOError:
+			return {}
+
+		try:
+			try:
+				signatures = cPickle.load(fin)
+			finally:
+				fin.close()
+		except:
+			if (self.verbose > 1):
+				sys.excepthook(*sys.exc_info())
+			return {}
+
+		if (type(signatures) is not dict):
+			return {}
+
+		return signatures
+
+	def incremental_save(self):
+		try:
+			fout = OpenTempRename(self.filename_incremental, 'wb')
+		except:
+			if (self.verbose > 0):
+				print 'Error: Cannot write file "%s"' % self.filename_incremental
+			return
+
+		cPickle.dump(self.incremental_signatures, fout.fd, cPickle.HIGHEST_PROTOCOL)
+
+	def extract_mesh(self, obj):
+		"""
+		Extract meshes, faces, normals, vertex colors and UV of the object
+		"""
+
+		# get meshes
+
+		try:
+			meshes = self.process_mesh_deformation(obj)
+		except:
+			if (self.verbose > 0):
+				sys.excepthook(*sys.exc_info())
+			return
+
+		nmeshes = len(meshes)
+		if (nmeshes < 1):
+			return
+
+		nfaces = len(meshes[0].faces)
+		if (nfaces < 1):
+			return
+
+		# get properties
+
+		catmull_clark = self.index.boolean(obj, 'catmull_clark')
+		raster_width  = self.index.boolean(obj, 'raster_width')
+		bake_diffuse  = self.index.boolean(obj, 'bake_diffuse')
+		enable_proxy  = self.index.boolean(obj, 'enable_proxy')
+
+		# single sided face
+
+		single_sided = not (self.enable_double_sided or (meshes[0].mode & Blender.Mesh.Modes.TWOSIDED))
+
+		# if NURBS smooth surfaces
+
+		all_smooth = (obj.type == 'Surf')
+
+		# primitive variables
+
+		primvars = self.pass_primvars(obj, meshes[0])
+
+		enable_normals = ('N' in primvars)
+
+		# vertex color
+
+		vtcolor = (('C' in primvars) and meshes[0].vertexColors)
+
+		# UV map
+
+		faceuv = (('st' in primvars) and self.enable_uv and meshes[0].faceUV)
+
+		# loop meshes
+
+		db_mesh = []
+
+		for mesh in meshes:
+
+			if (vtcolor):
+				nlist_col = range(len(mesh.verts))
+
+			# new mesh
+
+			dmesh = self.data_mesh(mesh.renderUVLayer)
+			db_mesh.append(dmesh)
+
+			db_geometry = dmesh.db_geometry
+
+			# loop faces
+
+			for index_face, face in enumerate(mesh.faces):
+
+				fsmooth = face.smooth
+				nverts  = len(face.verts)
+
+				# new geometry
+
+				dgeometry = db_geometry.setdefault(face.mat, self.data_geometry())
+
+				if (fsmooth):
+					dgeometry.smooth = True
+
+				dgeometry.index_faces.append(index_face)
+
+				if (catmull_clark):
+					dmesh.nverts.append(nverts)
+				else:
+					dgeometry.nverts.append(nverts)
+
+				# loop vertexes
+
+				if (catmull_clark):
+
+					for v in face.verts:
+
+						# vertexes index
+
+						dmesh.verts.append(v.index)
+				else:
+
+					for v in face.verts:
+
+						# vertexes index
+
+						dgeometry.verts.append(v.index)
+
+						# normals
+
+						if (enable_normals):
+							no = (v.no if (all_smooth or fsmooth) else face.no)
+
+							dgeometry.normals.extend([no[0], no[1], no[2]])
+
+				if (vtcolor):
+					for j in xrange(len(face.verts)):
+						c = face.col[j]
+						nlist_col[face.verts[j].index] = [c.r, c.g, c.b]
+
+			# loop vertexes
+
+			for v in mesh.verts:
+
+				# points
+
+				dmesh.points.extend([v.co.x, v.co.y, v.co.z])
+
+			# vertex color
+
+			if (vtcolor):
+				for c in nlist_col:
+					try:
+						dmesh.vertexcolors.extend([c[0]/255.0, c[1]/255.0, c[2]/255.0])
+					except:
+						dmesh.vertexcolors.extend(self._ZERO3)
+
+			# UV layers
+
+			if (faceuv):
+
+				# save UV layer name
 
 				actlname = mesh.activeUVLayer
 
@@ -2620,12 +3854,35 @@ class Gelato_pyg(object):
 
 					mesh.activeUVLayer = actlname
 
+		if (len(db_mesh) != nmeshes):
+			raise GelatoError, sys._getframe(0).f_code.co_name + ' invalid number of items'
+
+		return self.data_object(meshes, db_mesh, nfaces, catmull_clark, raster_width, bake_diffuse, enable_proxy,
+			single_sided, all_smooth)
+
+	def write_mesh(self, obj, dobj):
+		"""
+		Write materials and meshes of the object
+		"""
+
+		name = obj.name
+
+		meshes        = dobj.meshes
+		db_mesh       = dobj.db_mesh
+		nfaces        = dobj.nfaces
+		catmull_clark = dobj.catmull_clark
+		raster_width  = dobj.raster_width
+		bake_diffuse  = dobj.bake_diffuse
+		enable_proxy  = dobj.enable_proxy
+		single_sided  = dobj.single_sided
+		all_smooth    = dobj.all_smooth
+
 		nmesh = len(db_mesh)
+		dmesh = db_mesh[-1]
 
-		if (nmesh != nmeshes):
-			raise GelatoError, sys._getframe(0).f_code.co_name + ' invalid number of items'
+		# interpolation type
 
-		self.write_geometry_head(obj, matrices)
+		interpolation = ('catmull-clark' if (catmull_clark) else 'linear')
 
 		# bake diffuse
 
@@ -2653,7 +3910,7 @@ class Gelato_pyg(object):
 
 		if (enable_proxy):
 
-			proxy_file = property_string_get(obj, 'proxy_file')
+			proxy_file = self.index.string(obj, 'proxy_file')
 
 			if (proxy_file):
 
@@ -2739,13 +3996,17 @@ class Gelato_pyg(object):
 				# motion blur
 
 				if (self.current_pass != self.passes.shadows):
-					self.write_motion(nmesh)
+					self.write_motion(meshes)
 
 				# geometry
 
 				for mesh_index, dmesh in enumerate(db_mesh):
 
-					if (not self.enable_split):
+					if (self.enable_store):
+
+						wfile = cStringIO.StringIO()
+
+					elif (not self.enable_split):
 
 						wfile = self.file
 					else:
@@ -2756,7 +4017,7 @@ class Gelato_pyg(object):
 
 						if (fobj_name not in self.fileobject_memo):
 
-							wfile = open(fobj_name, 'wb')
+							wfile = self.open_output(fobj_name)
 							self.fileobject_memo.append(fobj_name)
 
 							if (self.verbose > 1):
@@ -2827,81 +4088,567 @@ class Gelato_pyg(object):
 
 					wfile.write(')\n')
 
-					if (self.enable_split):
+					if (self.enable_store):
+						self.file.write('Input ("%s")\n' % self.store_write(wfile.getvalue()))
+
+					elif (self.enable_split):
 						wfile.close()
 
 				self.write_material_tail(mat)
 
-		self.write_geometry_tail(obj)
+	def build(self, obj, fc, mblur = False):
+		if (not self.index.exported(obj)):
+			return
+
+		self.instance = None
+
+		if (self.enable_dupli_verts):
+			dupobjs = None
+
+			if (obj.name in self.index.dupli_parents):
+				# get duplicate object
+				dupobjs = obj.DupObjects
+
+			if (dupobjs):
+
+				self.instance = 0
+
+				# check is motion blur
+				if (mblur and (self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion])):
+					matrices = self.process_obj_transformation(obj, True, True)
+
+					for dobj, m_dummy in dupobjs:
+
+						new_matrices = []
+						for m in matrices:
+							new_matrices.append(m[self.instance])
+
+						fc(dobj, self.data_motion(new_matrices, matrices.times))
+						self.instance += 1
+				else:
+					for dobj, mat in dupobjs:
+
+						fc(dobj, self.data_motion([mat]))
+						self.instance += 1
+				return
+			elif (obj.name in self.index.dupli_children):
+				# skip object if DupObjects
+				return
+
+		matrices = self.process_obj_transformation(obj, mblur)
+
+		fc(obj, matrices)
 
-	def visible(self, obj):
+	def camera_frustum(self):
 		"""
-		Check if object is visible
+		Camera frustum used by the lights culling: position, view
+		direction, clipping range and radius as a linear function of depth
 		"""
 
-		if ((obj.users > 1) and ((frozenset(obj.layers) & self.viewlayer) == frozenset())):
-			if (self.verbose > 1):
-				print 'Info: Object "%s" invisible' % obj.name
+		curcam = self.scene.objects.camera
+		if (curcam is None):
+			return None
+
+		cam    = Blender.Camera.Get(curcam.data.name)
+		matrix = curcam.matrix
+
+		position  = Blender.Mathutils.Vector(matrix[3][0], matrix[3][1], matrix[3][2])
+		direction = -Blender.Mathutils.Vector(matrix[2][0], matrix[2][1], matrix[2][2])
+		direction.normalize()
+
+		# the longest side of the image has 32 units of film
+
+		ratio    = min(self.sizex, self.sizey) / max(self.sizex, self.sizey)
+		diagonal = math.sqrt(1.0 + ratio * ratio)
+
+		if (cam.type == 'ortho'):
+			radius  = cam.scale / 2.0 * diagonal
+			tangent = 0.0
+		else:
+			radius  = 0.0
+			tangent = 16.0 / cam.lens * diagonal
+
+		return (position, direction, cam.clipStart, cam.clipEnd, radius, tangent)
+
+	def camera_screen(self):
+		"""
+		Camera projection used by the adaptive motion blur: position, view
+		direction, near plane, pixels per unit length (at unit depth if
+		perspective) and perspective flag
+		"""
+
+		curcam = self.scene.objects.camera
+		if (curcam is None):
+			return None
+
+		cam    = Blender.Camera.Get(curcam.data.name)
+		matrix = curcam.matrix
+
+		position  = (matrix[3][0], matrix[3][1], matrix[3][2])
+		length    = math.sqrt(matrix[2][0] ** 2 + matrix[2][1] ** 2 + matrix[2][2] ** 2)
+		direction = (-matrix[2][0] / length, -matrix[2][1] / length, -matrix[2][2] / length)
+
+		resolution = max(self.sizex, self.sizey) * self.context.getRenderWinSize() / 100.0
+
+		if (cam.type == 'ortho'):
+			return (position, direction, cam.clipStart, resolution / cam.scale, False)
+
+		return (position, direction, cam.clipStart, resolution * cam.lens / 32.0, True)
+
+	def frustum_distance(self, frustum, point):
+		"""
+		Approximate distance of a point from the camera frustum (0.0 if inside)
+		"""
+
+		(position, direction, near, far, radius, tangent) = frustum
+
+		v = point - position
+
+		depth = Blender.Mathutils.DotVecs(v, direction)
+		axial = (v - direction * depth).length
+
+		depth_clamp = clamp(depth, near, far)
+
+		gap_radial = max(0.0, axial - (radius + depth_clamp * tangent))
+		gap_axial  = depth - depth_clamp
+
+		return math.sqrt(gap_radial * gap_radial + gap_axial * gap_axial)
+
+	def light_importance(self, frustum, obj, lamp):
+		"""
+		Estimate the contribution of a lamp over the camera frustum,
+		None if the lamp must be always exported
+		"""
+
+		ltype = lamp.type
+
+		if (ltype not in [Blender.Lamp.Types.Lamp, Blender.Lamp.Types.Spot]):
+			return None
+
+		# shader light, scripts and photon map
+
+		if (gelato_gui.assigned_light[1].get(lamp.name) is not None):
+			return None
+
+		if (self.enable_scripts and (self.index.boolean(obj, 'enable_script') or
+			self.index.boolean(obj, 'enable_prescript') or self.index.boolean(obj, 'enable_postscript'))):
+				return None
+
+		if (self.index.boolean(obj, 'photon_map')):
+			return None
+
+		matrix = obj.matrix
+		point  = Blender.Mathutils.Vector(matrix[3][0], matrix[3][1], matrix[3][2])
+
+		distance = self.frustum_distance(frustum, point)
+		if (distance < self.EPSILON):
+			return None
+
+		# clipping sphere
+
+		if ((lamp.mode & Blender.Lamp.Modes.Sphere) and (distance > lamp.dist)):
+			return 0.0
+
+		# spot cone against the bounding sphere of the frustum
+
+		if (ltype == Blender.Lamp.Types.Spot):
+			(position, direction, near, far, radius, tangent) = frustum
+
+			center = position + direction * ((near + far) / 2.0)
+			bound  = math.sqrt(((far - near) / 2.0) ** 2 + (radius + far * tangent) ** 2)
+
+			to_center = center - point
+			length    = to_center.length
+
+			if (length > bound):
+				spot = -Blender.Mathutils.Vector(matrix[2][0], matrix[2][1], matrix[2][2])
+				spot.normalize()
+
+				cosine = clamp(Blender.Mathutils.DotVecs(spot, to_center) / length, -1.0, 1.0)
+				angle  = math.acos(cosine) - math.asin(bound / length)
+
+				if (angle > math.radians(lamp.spotSize / 2.0)):
+					return 0.0
+
+		# falloff 2.0
+
+		intensity = abs(lamp.getEnergy() * self.lights_factor) * max(lamp.R, lamp.G, lamp.B)
+
+		return intensity / (distance * distance)
+
+	def lights_culling(self):
+		"""
+		Names of the lamps with a contribution below the threshold
+		"""
+
+		culled = set()
+
+		frustum = self.camera_frustum()
+		if (frustum is None):
+			return culled
+
+		for obj in self.index.lights:
+			if (obj.type != 'Lamp'):
+				continue
+
+			lamp = self.index.lamp(obj)
+
+			importance = self.light_importance(frustum, obj, lamp)
+			if ((importance is not None) and (importance < self.lights_threshold)):
+				culled.add(obj.name)
+
+				if (self.verbose > 0):
+					print 'Info: culled lamp "%s" (importance %s)' % (obj.name, round(importance, self.PRECISION))
+
+		if (self.verbose > 0):
+			print 'Info: culled %d lamps' % len(culled)
+
+		return culled
+
+	def object_materials(self, obj):
+		"""
+		Materials of a mesh object without the mesh evaluation
+		"""
+
+		mesh = obj.getData(mesh = True)
+
+		materials = []
+		for (idx, mat) in enumerate(mesh.materials):
+			if (obj.colbits & (1 << idx)):
+				try:
+					mat = obj.getMaterials()[idx]
+				except:
+					mat = None
+			materials.append(mat)
+
+		return materials
+
+	def pass_filter_object(self, obj, current_pass):
+		"""
+		Check if object cannot affect the pass
+		"""
+
+		if (obj.type != 'Mesh'):
+			return False
+
+		# custom scripts and proxy
+
+		if (self.enable_scripts and (self.index.boolean(obj, 'enable_prescript') or self.index.boolean(obj, 'enable_postscript'))):
+			return False
+
+		if (self.index.boolean(obj, 'enable_proxy')):
+			return False
+
+		if (obj.name in self.index.dupli_parents):
+			return False
+
+		if (current_pass == self.passes.bake_diffuse):
+			return not self.index.boolean(obj, 'bake_diffuse')
+
+		materials = self.object_materials(obj)
+		if ((not materials) or (None in materials)):
 			return False
+
+		for mat in materials:
+			if (self.enable_scripts and (self.index.material_boolean(mat, 'enable_prescript') or
+				self.index.material_boolean(mat, 'enable_script') or self.index.material_boolean(mat, 'enable_postscript'))):
+					return False
+
+			flags = mat.mode
+
+			if (current_pass == self.passes.shadows):
+				if (flags & Blender.Material.Modes.TRACEABLE):
+					return False
+
+			elif (current_pass == self.passes.photon_map):
+				if (flags & (Blender.Material.Modes.RAYMIRROR | Blender.Material.Modes.RAYTRANSP)):
+					return False
+
 		return True
 
-	def build(self, obj, fc, mblur = False):
-		if ((not self.visible(obj)) or property_boolean_get(obj, 'excluded')):
-			return
+	def build_pass_filter(self):
+		"""
+		Names of the objects to skip for each pass
+		"""
+
+		passes = []
+
+		if (self.pass_shadows):
+			passes.append(self.passes.shadows)
+
+		if (self.pass_photon_maps):
+			passes.append(self.passes.photon_map)
+
+		if (self.pass_bake_diffuse):
+			passes.append(self.passes.bake_diffuse)
+
+		pass_filter = {}
+
+		for current_pass in passes:
+			skip = pass_filter[current_pass] = set()
+
+			for obj in self.index.geometries:
+				try:
+					if (self.pass_filter_object(obj, current_pass)):
+						skip.add(obj.name)
+				except:
+					if (self.verbose > 1):
+						sys.excepthook(*sys.exc_info())
+
+			if (self.verbose > 1):
+				print 'Info: pass "%s" skip %d objects' % (self.passes[current_pass], len(skip))
+
+		return pass_filter
+
+	def ray_traced_material(self, mat):
+		"""
+		Check if material can trace reflection or refraction rays
+		"""
+
+		if (mat.mode & (Blender.Material.Modes.RAYMIRROR | Blender.Material.Modes.RAYTRANSP)):
+			return True
+
+		if (gelato_gui.assigned_material[1].get(mat.name) is not None):
+			return True
+
+		if (self.enable_scripts and (self.index.material_boolean(mat, 'enable_prescript') or
+			self.index.material_boolean(mat, 'enable_script') or self.index.material_boolean(mat, 'enable_postscript'))):
+				return True
+
+		return False
+
+	def ray_traced_scene(self):
+		"""
+		Check if some object of the scene can trace reflection or refraction rays
+		"""
+
+		# instances and scripts are unknown
+
+		if (self.index.dupli_parents):
+			return True
+
+		for obj in self.index.geometries:
+
+			if (self.enable_scripts and (self.index.boolean(obj, 'enable_prescript') or self.index.boolean(obj, 'enable_postscript'))):
+				return True
+
+			try:
+				if (obj.type == 'Mesh'):
+					materials = self.object_materials(obj)
+				else:
+					materials = obj.getMaterials() + obj.getData().materials
+			except:
+				if (self.verbose > 1):
+					sys.excepthook(*sys.exc_info())
+				return True
+
+			for mat in materials:
+				if ((mat is not None) and self.ray_traced_material(mat)):
+					return True
+
+		return False
+
+	def ray_visible_object(self, obj):
+		"""
+		Check if object can be seen by the reflection and refraction rays:
+		not excluded by the ray traced property and with some traceable material
+		"""
+
+		if (not self.index.boolean(obj, 'ray_traced', True)):
+			return False
+
+		# unknown materials are visible
+
+		if (obj.type != 'Mesh'):
+			return True
+
+		if (self.enable_scripts and (self.index.boolean(obj, 'enable_prescript') or self.index.boolean(obj, 'enable_postscript'))):
+			return True
+
+		materials = self.object_materials(obj)
+		if ((not materials) or (None in materials)):
+			return True
+
+		for mat in materials:
+			if (mat.mode & Blender.Material.Modes.TRACEABLE):
+				return True
+
+			if (gelato_gui.assigned_material[1].get(mat.name) is not None):
+				return True
+
+		return False
+
+	def build_ray_traced_objects(self):
+		"""
+		Names of the objects added to the reflection and refraction geometry sets:
+		the objects visible to rays, none if nothing can trace
+		reflection or refraction rays
+		"""
+
+		ray_traced = set()
+
+		if (self.ray_traced_scene()):
+			for obj in self.index.geometries:
+				try:
+					visible = self.ray_visible_object(obj)
+				except:
+					visible = True
+
+					if (self.verbose > 1):
+						sys.excepthook(*sys.exc_info())
+
+				if (visible):
+					ray_traced.add(obj.name)
+
+		if (self.verbose > 1):
+			print 'Info: %d objects ray traced' % len(ray_traced)
+
+		return ray_traced
+
+	def material_animated(self, mat):
+		"""
+		Check if the material changes along the frames
+		"""
+
+		if (mat.ipo is not None):
+			return True
+
+		for mtex in mat.getTextures():
+			if ((not mtex) or (not mtex.tex)):
+				continue
+
+			if (mtex.tex.ipo is not None):
+				return True
+
+			if (mtex.tex.type is Blender.Texture.Types.IMAGE):
+				image = mtex.tex.getImage()
+				if (image and (image.source in [Blender.Image.Sources.SEQUENCE, Blender.Image.Sources.MOVIE])):
+					return True
+
+		if (self.enable_scripts and self.index.material_boolean(mat, 'enable_postscript')):
+			return True
+
+		for assigned in [gelato_gui.assigned_material[1], gelato_gui.assigned_displacement[1]]:
+			sd = assigned.get(mat.name)
+			if ((sd is not None) and sd.has_variables()):
+				return True
+
+		return False
+
+	def classify_animation(self, obj, memo):
+		"""
+		Classify the object as static, transform-only or deforming
+		along the frame range (conservative)
+		"""
+
+		name = obj.name
+
+		cls = memo.get(name)
+		if (cls is not None):
+			return cls
+
+		deform = self.animations.deform
+
+		# guard against recursive parents
+
+		memo[name] = deform
+
+		if (name in self.index.dupli_parents):
+			return deform
+
+		ty = obj.type
+
+		if (ty in ['Mesh', 'Surf']):
+
+			if (self.index.boolean(obj, 'bake_diffuse') or obj.isSB()):
+				return deform
+
+			# shape keys
+
+			data = obj.getData(mesh = (ty == 'Mesh'))
+
+			key = getattr(data, 'key', None)
+			if ((key is not None) and (key.ipo is not None)):
+				return deform
+
+			# modifiers
+
+			for mod in obj.modifiers:
+				if (mod.type not in self.static_modifiers):
+					return deform
+
+			# materials
+
+			if (ty == 'Mesh'):
+				materials = self.object_materials(obj)
+			else:
+				materials = obj.getMaterials() + data.materials
+
+			for mat in materials:
+				if ((mat is not None) and self.material_animated(mat)):
+					return deform
+
+		# transformation
+
+		cls = self.animations.static
+
+		if ((obj.ipo is not None) or (len(obj.constraints) > 0) or (obj.track is not None)):
+			cls = self.animations.transform
+
+		# poses, lattice keys and paths move their children (conservative)
+
+		elif (ty in ['Armature', 'Lattice', 'Curve']):
+			cls = self.animations.transform
+
+		parent = obj.parent
 
-		self.instance = None
+		if (parent is not None):
+			cls_parent = self.classify_animation(parent, memo)
 
-		if (self.enable_dupli_verts):
-			try:
-				# get duplicate object
-				dupobjs = obj.DupObjects
-			except:
-				dupobjs = None
+			if (cls_parent != self.animations.static):
+				if (obj.parentType in [Blender.Object.ParentTypes.ARMATURE, Blender.Object.ParentTypes.LATTICE]):
+					return deform
 
-			if (dupobjs):
+				cls = self.animations.transform
 
-				self.instance = 0
+		memo[name] = cls
 
-				# check is motion blur
-				if (mblur and (self.current_pass in [self.passes.beauty, self.passes.ambient_occlusion])):
-					matrices = self.process_obj_transformation(obj, True, True)
+		return cls
 
-					for dobj, m_dummy in dupobjs:
+	def build_animation_classes(self):
+		memo = {}
+		classes = {}
 
-						new_matrices = []
-						for m in matrices:
-							new_matrices.append(m[self.instance])
+		for obj in self.index.geometries:
+			try:
+				classes[obj.name] = self.classify_animation(obj, memo)
+			except:
+				if (self.verbose > 1):
+					sys.excepthook(*sys.exc_info())
 
-						fc(dobj, new_matrices)
-						self.instance += 1
-				else:
-					for dobj, mat in dupobjs:
+		if (self.verbose > 1):
+			for (idx, cls) in self.animations:
+				print 'Info: %s objects: %d' % (cls, len([c for c in classes.itervalues() if (c == idx)]))
 
-						fc(dobj, [mat])
-						self.instance += 1
-				return
-			else:
-				try:
-					# skip object if DupObjects
-					if (obj.parent and obj.parent.DupObjects):
-						return
-				except:
-					pass
+		return classes
 
-		matrices = self.process_obj_transformation(obj, mblur)
+	def animation_class(self, obj):
+		return self.animation_classes.get(obj.name, self.animations.deform)
 
-		fc(obj, matrices)
+	def static_geometries(self, objects):
+		for obj in objects:
+			self.build(obj, self.generate_mesh, self.enable_motion_blur)
 
 	def lights_to_cameras(self):
-		for obj in self.objects:
+		for obj in self.index.lights:
 			self.build(obj, self.generate_camera_shadows)
 
 	def lights_to_photon_maps(self):
-		for obj in self.objects:
+		for obj in self.index.lights:
 			self.build(obj, self.generate_camera_photon_map)
 
 	def lights(self):
-		n = len(self.objects)
+		n = len(self.index.lights)
 
 		message = 'Lights ...'
 		if (self.frame is not None):
@@ -2912,7 +4659,7 @@ class Gelato_pyg(object):
 		if (self.current_pass != self.passes.photon_map):
 			self.write_ambientlight()
 
-		for i, obj in enumerate(self.objects):
+		for i, obj in enumerate(self.index.lights):
 
 			self.pbar(i)
 
@@ -2921,7 +4668,7 @@ class Gelato_pyg(object):
 		self.pbar.finish()
 
 	def geometries(self):
-		n = len(self.objects)
+		n = len(self.index.geometries)
 
 		message = 'Geometries ...'
 		if (self.frame is not None):
@@ -2929,15 +4676,32 @@ class Gelato_pyg(object):
 
 		self.pbar.setup(0, n - 1, message)
 
-		for i, obj in enumerate(self.objects):
+		skip = self.pass_filter.get(self.current_pass, ())
+
+		static = []
+
+		for i, obj in enumerate(self.index.geometries):
 
 			self.pbar(i)
 
+			if (obj.name in skip):
+				continue
+
+			# static objects in animation are written once
+
+			if ((self.animation_classes is not None) and (self.animation_class(obj) == self.animations.static)):
+				static.append(obj)
+				continue
+
 			if (self.verbose > 1):
 				print 'Info: Object "%s" type "%s"' % (obj.name, obj.type)
 
 			self.build(obj, self.generate_mesh, self.enable_motion_blur)
 
+		if (static):
+			self.file.write('\n')
+			self.write_include(self.file_static_name(), self.static_geometries, static)
+
 		self.pbar.finish()
 
 	def write_head(self):
@@ -3230,7 +4994,7 @@ class Gelato_pyg(object):
 		fileout = self.file_output_pass()
 
 		try:
-			self.file = open(fileout, 'wb')
+			self.file = self.open_output(fileout)
 
 		except IOError:
 
@@ -3315,6 +5079,57 @@ class Gelato_pyg(object):
 
 		self.fileobject_memo = []
 
+		# clear materials memo
+
+		self.material_memo  = {}
+		self.material_files = {}
+
+		# snapshot of the frame
+
+		if (self.enable_snapshot and USE_GELATOSNAP):
+			filename = str(self.name_mask(self, '', self.EXT_SNAPSHOT))
+
+			self.snapshot = gelatosnap.SnapshotWriter(filename, binary = bool(self.enable_binary), precision = self.PRECISION)
+
+			# each snapshot holds all its includes and store files
+
+			self.include_memo = set()
+			self.store_memo   = set()
+
+			try:
+				self.sequence_all()
+			finally:
+				snapshot = self.snapshot
+				self.snapshot = None
+
+			try:
+				snapshot.close()
+			except (IOError, OSError):
+				raise GelatoError, 'Cannot write file "%s"' % filename
+
+			self.snapshot_files.append(filename)
+
+			if (self.verbose > 1):
+				print 'Info: exporting snapshot "%s"' % filename
+		else:
+			self.sequence_all()
+
+	def sequence_all(self):
+
+		# adaptive motion blur
+
+		if (self.enable_motion_blur and self.enable_adaptive_motion):
+			self.screen = self.camera_screen()
+		else:
+			self.screen = None
+
+		# lights culling
+
+		if (self.enable_lights and self.enable_lights_culling):
+			self.culled_lights = self.lights_culling()
+		else:
+			self.culled_lights = set()
+
 		# all passes
 
 		if (self.pass_shadows):
@@ -3466,11 +5281,11 @@ class Gelato_pyg(object):
 
 		Sbase.verbose = self.verbose
 
-		# actives layer
+		self.objects = scene.objects
 
-		self.viewlayer = frozenset(Blender.Window.ViewLayers())
+		# scene index
 
-		self.objects = scene.objects
+		self.index = self.scene_index(self.objects, self.verbose)
 
 		self.world = Blender.World.GetCurrent()
 
@@ -3480,6 +5295,61 @@ class Gelato_pyg(object):
 
 		self.filetexture_memo = {}
 
+		# selective ray traced
+
+		if (self.enable_ray_traced and self.ray_traced_selective):
+			self.ray_traced_objects = self.build_ray_traced_objects()
+		else:
+			self.ray_traced_objects = None
+
+		# objects to skip for each pass
+
+		if (self.enable_pass_filter):
+			self.pass_filter = self.build_pass_filter()
+		else:
+			self.pass_filter = {}
+
+		# static and transform-only objects in animation
+
+		self.include_memo = set()
+
+		# content-addressed geometry store
+
+		self.store_directory = os.path.join(self.directory, STORE_DIRECTORY)
+		self.store_memo = set()
+
+		if (self.enable_store and (not os.path.isdir(self.store_directory))):
+			try:
+				os.makedirs(self.store_directory)
+			except OSError:
+				raise GelatoError, 'Cannot create directory "%s"' % self.store_directory
+
+		# snapshots written
+
+		self.snapshot_files = []
+
+		# incremental export
+
+		self.filename_incremental = self.base + '.incremental'
+
+		if (self.enable_incremental):
+			self.config_signature       = self.build_config_signature()
+			self.material_signatures    = {}
+			self.incremental            = self.incremental_load()
+			self.incremental_signatures = {}
+		else:
+			self.incremental = None
+
+		if (self.enable_anim and self.enable_anim_cache):
+			self.animation_classes = self.build_animation_classes()
+		else:
+			self.animation_classes = None
+
+		# no redraw while exporting
+
+		redraw = Sbase.redraw
+		Sbase.redraw = False
+
 		try:
 			if (self.enable_anim):
 
@@ -3514,6 +5384,11 @@ class Gelato_pyg(object):
 
 				self.sequence_pass()
 
+			# save signatures of the incremental export
+
+			if (self.incremental is not None):
+				self.incremental_save()
+
 			# command file
 
 			if ((self.frame is not None) or (self.npasses > 1) or self.pass_ambient_occlusion):
@@ -3536,6 +5411,10 @@ class Gelato_pyg(object):
 		finally:
 			self.pbar.finish()
 
+			Sbase.redraw = redraw
+			if (INTERACTIVE and redraw):
+				Blender.Draw.Redraw(1)
+
 		if (editmode):
 			Blender.Window.EditMode(1)
 
@@ -3545,6 +5424,11 @@ class Gelato_pyg(object):
 
 class GUI_Config(object):
 
+	# panels initialised on the first draw: their widgets are only
+	# unnamed local ones, never read by the export or the config
+
+	panels_lazy = ['panel_objects']
+
 	def __init__(self):
 		self.middle_button = False
 		self.mouse_old_x = 0
@@ -3564,16 +5448,24 @@ class GUI_Config(object):
 		self.assigned_displacement = [{}, {}]
 		self.assigned_light        = [{}, {}]
 
-		# widget color
+		# widget color (only to draw the GUI)
 
-		self.color_bg      = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.5325, 0.6936, 0.0])
-		self.color_text    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.0, 0.0, 0.0])
-		self.color_evident = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [1.0, 1.0, 0.8])
+		if (INTERACTIVE):
+			self.color_bg      = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.5325, 0.6936, 0.0])
+			self.color_text    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.0, 0.0, 0.0])
+			self.color_evident = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [1.0, 1.0, 0.8])
 
-		self.color_rect_sw = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.2, 0.2, 0.2])
-		self.color_rect    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.2392, 0.3098, 1.0])
+			self.color_rect_sw = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.2, 0.2, 0.2])
+			self.color_rect    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.2392, 0.3098, 1.0])
 
-		self.color_line    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.4, 0.4, 0.4])
+			self.color_line    = Blender.BGL.Buffer(Blender.BGL.GL_FLOAT, 3, [0.4, 0.4, 0.4])
+		else:
+			self.color_bg      = None
+			self.color_text    = None
+			self.color_evident = None
+			self.color_rect_sw = None
+			self.color_rect    = None
+			self.color_line    = None
 
 		# panels
 
@@ -3612,13 +5504,11 @@ class GUI_Config(object):
 
 		self.panel_common_init()
 
-		for (f, pan) in self.panels:
-			try:
-				exec 'self.' + f.__name__ + '_init()'
+		self.panels_ready = set()
 
-			except:
-				if (Sbase.verbose > 0):
-					sys.excepthook(*sys.exc_info())
+		for (f, pan) in self.panels:
+			if (f.__name__ not in self.panels_lazy):
+				self.panel_init(f)
 
 		# config filename
 
@@ -3633,6 +5523,7 @@ class GUI_Config(object):
 			base = 'gelato'
 
 		self.config_filename = base + '.xml'
+		self.config_signature_saved = None
 
 		GUI_Base.home()
 
@@ -3651,84 +5542,119 @@ class GUI_Config(object):
 		assigned_light_internal['indirect_light'] = None
 		assigned_light_internal['caustic_light']  = None
 
+		# internal shaders by name, all shaders when first shown
+
+		self.shaders_loaded = False
+
+		for name in ['ambocclude', 'shootphotons', 'bakediffuse', 'envlight', 'indirectlight', 'causticlight']:
+			for (filename, path) in find_files(name + '.gso', self.gui_path_shader.val).iteritems():
+				self.add_shader(filename, path, False)
+
+		for data in [assigned_material_internal, assigned_light_internal]:
+			for k, d in data.iteritems():
+				if (d is None):
+					print 'Error: shader "%s" not found disabled' % k
+
+	def load_shaders(self):
+		"""
+		Load all the shaders of the search path
+		"""
+
+		if (self.shaders_loaded):
+			return
+
+		self.shaders_loaded = True
+
 		available_shaders = find_files('*.gso', self.gui_path_shader.val)
 		if (available_shaders):
 
+			# run gsoinfo in parallel for the new shaders
+
+			if (shader_cache is not None):
+				shader_cache.update([os.path.join(path, filename) for (filename, path) in sorted(available_shaders.iteritems())])
+
 			for (filename, path) in sorted(available_shaders.iteritems()):
-				fd = os.path.join(path, filename)
-				try:
-					sd = Shader(fd)
+				self.add_shader(filename, path)
 
-					ty = sd.type
-					if (ty is None):
-						continue
+			if (shader_cache is not None):
+				shader_cache.save()
 
-					(base, ext) = os.path.splitext(filename)
+	def add_shader(self, filename, path, lists = True):
 
-					# surface, generic
+		assigned_material_internal = self.assigned_material[0]
+		assigned_light_internal    = self.assigned_light[0]
 
-					if (ty in [Sbase.types.surface, Sbase.types.generic]):
+		fd = os.path.join(path, filename)
+		try:
+			sd = Shader(fd)
 
-						self.list_shaders_surface.append([base, copy.deepcopy(sd)])
+			ty = sd.type
+			if (ty is None):
+				return
 
-						# shaders debug
+			(base, ext) = os.path.splitext(filename)
 
-						if (base in ['shownormals', 'showfacing', 'showst', 'showuv', 'showdudv', 'showgrids', 'raygoggles']):
-							self.list_shaders_debug.append([base, copy.deepcopy(sd)])
+			# surface, generic
 
-						if ((base == 'ambocclude') and (assigned_material_internal.get('ambient_occlusion') is None)):
-							assigned_material_internal['ambient_occlusion'] = copy.deepcopy(sd)
-						elif ((base == 'shootphotons') and (assigned_material_internal.get('shoot_photons') is None)):
-							assigned_material_internal['shoot_photons'] = copy.deepcopy(sd)
-						elif ((base == 'bakediffuse') and (assigned_material_internal.get('bake_diffuse') is None)):
-							assigned_material_internal['bake_diffuse'] = copy.deepcopy(sd)
+			if (ty in [Sbase.types.surface, Sbase.types.generic]):
 
-					# displacement
+				if (lists):
+					self.list_shaders_surface.append([base, copy.deepcopy(sd)])
 
-					elif (ty is Sbase.types.displacement):
+					# shaders debug
 
-						self.list_shaders_displacement.append([base, copy.deepcopy(sd)])
+					if (base in ['shownormals', 'showfacing', 'showst', 'showuv', 'showdudv', 'showgrids', 'raygoggles']):
+						self.list_shaders_debug.append([base, copy.deepcopy(sd)])
 
-					# light
+				if ((base == 'ambocclude') and (assigned_material_internal.get('ambient_occlusion') is None)):
+					assigned_material_internal['ambient_occlusion'] = copy.deepcopy(sd)
+				elif ((base == 'shootphotons') and (assigned_material_internal.get('shoot_photons') is None)):
+					assigned_material_internal['shoot_photons'] = copy.deepcopy(sd)
+				elif ((base == 'bakediffuse') and (assigned_material_internal.get('bake_diffuse') is None)):
+					assigned_material_internal['bake_diffuse'] = copy.deepcopy(sd)
 
-					elif (ty is Sbase.types.light):
+			# displacement
 
-						self.list_shaders_light.append([base, copy.deepcopy(sd)])
+			elif (ty is Sbase.types.displacement):
 
-						if (base == 'envlight'):
+				if (lists):
+					self.list_shaders_displacement.append([base, copy.deepcopy(sd)])
 
-							envlight = assigned_light_internal.get('shoot_photons')
-							if (envlight is None):
-								envlight = assigned_light_internal['shoot_photons'] = copy.deepcopy(sd)
+			# light
 
-							envlight.nameid = '__envlight_pass2__'
-							envlight['occlusionmap'] = '$FILE_PASS1'
+			elif (ty is Sbase.types.light):
 
-						elif (base == 'indirectlight'):
+				if (lists):
+					self.list_shaders_light.append([base, copy.deepcopy(sd)])
 
-							indirectlight = assigned_light_internal.get('indirect_light')
-							if (indirectlight is None):
-								indirectlight = assigned_light_internal['indirect_light'] = copy.deepcopy(sd)
+				if (base == 'envlight'):
 
-							indirectlight.nameid = '__indirectlight__'
+					envlight = assigned_light_internal.get('shoot_photons')
+					if (envlight is None):
+						envlight = assigned_light_internal['shoot_photons'] = copy.deepcopy(sd)
 
-						elif (base == 'causticlight'):
+						envlight.nameid = '__envlight_pass2__'
+						envlight['occlusionmap'] = '$FILE_PASS1'
 
-							causticlight = assigned_light_internal.get('caustic_light')
-							if (causticlight is None):
-								causticlight = assigned_light_internal['caustic_light'] = copy.deepcopy(sd)
+				elif (base == 'indirectlight'):
 
-							causticlight.nameid = '__causticlight__'
+					indirectlight = assigned_light_internal.get('indirect_light')
+					if (indirectlight is None):
+						indirectlight = assigned_light_internal['indirect_light'] = copy.deepcopy(sd)
 
-				except:
-					sys.excepthook(*sys.exc_info())
-					print 'Error: shader "%s" not found disabled' % filename
+						indirectlight.nameid = '__indirectlight__'
 
-		for data in [assigned_material_internal, assigned_light_internal]:
-			for k, d in data.iteritems():
-				if (d is None):
-					print 'Error: shader "%s" not found disabled' % k
+				elif (base == 'causticlight'):
+
+					causticlight = assigned_light_internal.get('caustic_light')
+					if (causticlight is None):
+						causticlight = assigned_light_internal['caustic_light'] = copy.deepcopy(sd)
+
+						causticlight.nameid = '__causticlight__'
 
+		except:
+			sys.excepthook(*sys.exc_info())
+			print 'Error: shader "%s" not found disabled' % filename
 
 	def draw(self):
 
@@ -3882,6 +5808,18 @@ class GUI_Config(object):
 
 			filename = self.gui_filename.val
 
+			# generate pyg files from the snapshots
+
+			for snapshot in pyg.snapshot_files:
+				try:
+					snap = gelatosnap.Snapshot(snapshot)
+					try:
+						snap.generate()
+					finally:
+						snap.close()
+				except (IOError, gelatosnap.SnapshotError), strerror:
+					raise GelatoError, str(strerror)
+
 			if (os.path.isfile(filename)):
 
 				pid = subprocess.Popen([GELATO, filename]).pid
@@ -3929,6 +5867,22 @@ class GUI_Config(object):
 	def cb_error_filename(self, event, val):
 		Blender.Window.FileSelector(self.cb_errorselect, '.txt', self.gui_error_filename.val)
 
+	# callback clean store
+
+	def cb_store_gc(self, event, val):
+		ret = Blender.Draw.PupMenu('Remove unreferenced store files ?%t|no%x1|yes%x2')
+		if (ret != 2):
+			return
+
+		filename = fix_file_name(self.gui_filename.val)
+
+		directory = os.path.dirname(filename)
+		(base, ext) = os.path.splitext(filename)
+
+		(removed, kept) = store_collect(directory, ext, [pyg.EXT_SNAPSHOT])
+
+		print 'Info: store "%s" removed %d files, kept %d files' % (os.path.join(directory, STORE_DIRECTORY), removed, kept)
+
 	# callback pass
 
 	def cb_pass(self, event, val):
@@ -4022,6 +5976,21 @@ class GUI_Config(object):
 		if (obj):
 			property_set(obj, 'motionblur_deformation', val)
 
+	def cb_geo_motion_samples(self, event, val):
+		obj = self.active_obj
+		if (obj):
+			property_set(obj, 'motion_samples', val)
+
+	def cb_geo_ray_traced(self, event, val):
+		obj = self.active_obj
+		if (obj):
+			property_set(obj, 'ray_traced', val)
+
+	def cb_geo_all_primvars(self, event, val):
+		obj = self.active_obj
+		if (obj):
+			property_set(obj, 'all_primvars', val)
+
 	# callback proxy
 
 	def cb_geo_enable_proxy(self, event, val):
@@ -4180,6 +6149,14 @@ class GUI_Config(object):
 		except:
 			sys.excepthook(*sys.exc_info())
 
+	def cb_disp_maxradius(self, event, val):
+		try:
+			mat = Blender.Material.Get(self.gui_menu_material.val)
+		except:
+			return
+
+		property_set(mat, 'maxradius', float(val))
+
 	# callback light
 
 	def cb_lamp_photon_map(self, event, val):
@@ -4278,8 +6255,28 @@ class GUI_Config(object):
 		# call function's panel
 
 		if (func):
+			self.panel_init(func)
 			func()
 
+	def panel_init(self, func):
+		"""
+		Create the widgets of a panel once
+		"""
+
+		name = func.__name__
+
+		if (name in self.panels_ready):
+			return
+
+		self.panels_ready.add(name)
+
+		try:
+			getattr(self, name + '_init')()
+
+		except:
+			if (Sbase.verbose > 0):
+				sys.excepthook(*sys.exc_info())
+
 	def panel_common_init(self):
 
 		self.gui_save    = GUI_Button('local', None, 'Save',    70, func = self.cb_save,    help = 'Save pyg file')
@@ -4309,6 +6306,8 @@ class GUI_Config(object):
 		self.gui_pass_photon_maps       = GUI_Toggle('config', 'pass_photon_maps',       'Photon map',        w, default = 0, func = f, help = 'Enable photon map pass')
 		self.gui_pass_bake_diffuse      = GUI_Toggle('config', 'pass_bake_diffuse',      'Bake diffuse',      w, default = 0, func = f, help = 'Enable bake diffuse pass')
 
+		self.gui_enable_pass_filter = GUI_Toggle('config', 'enable_pass_filter', 'Filter objects', w, default = 1, help = 'Skip the objects that cannot affect the shadows, photon map and bake diffuse passes')
+
 	def panel_pass(self):
 
 		self.gui_pass_beauty.draw()
@@ -4337,6 +6336,10 @@ class GUI_Config(object):
 
 			self.gui_pass_bake_diffuse.draw()
 
+		GUI_Base.line_feed()
+
+		self.gui_enable_pass_filter.draw()
+
 	def panel_output_init(self):
 
 		# file name
@@ -4365,16 +6368,22 @@ class GUI_Config(object):
 
 		self.gui_viewer         = GUI_Toggle('config', 'enable_viewer',         'Viewer',         100, default = 1, help = 'Enable window viewer')
 		self.gui_split          = GUI_Toggle('config', 'enable_split',          'Split',          100, default = 0, help = 'Split out objects into separate files')
+		self.gui_store          = GUI_Toggle('config', 'enable_store',          'Store',          100, default = 0, help = 'Write each unique geometry once in the store directory, named by its hash')
+		self.gui_snapshot       = GUI_Toggle('config', 'enable_snapshot',       'Snapshot',       100, default = 0, help = 'Write a self-contained snapshot of each frame, the pyg files are generated from it (ASCII or binary arrays, see gelatosnap.py)')
+		self.gui_material_library = GUI_Toggle('config', 'enable_material_library', 'Materials includes', 130, default = 0, help = 'Write each material once in an include file named by its hash')
+		self.gui_incremental    = GUI_Toggle('config', 'enable_incremental',    'Incremental',    100, default = 0, help = 'Reuse the files of the objects unchanged since the last export')
 		self.gui_binary         = GUI_Toggle('config', 'enable_binary',         'Binary',         100, default = 0, help = 'Enable binary file')
 		self.gui_relative_paths = GUI_Toggle('config', 'enable_relative_paths', 'Relative paths', 100, default = 1, help = 'Enable relative paths')
 		self.gui_pack_config    = GUI_Toggle('blend',  'pack_config',           'Pack config',    100, default = 0, help = 'Enable pack config file (*.xml)')
 		self.gui_auto           = GUI_Toggle('config', 'enable_auto_threads',   'Auto',           100, default = 1, help = 'Auto detect')
 		self.gui_anim           = GUI_Toggle('config', 'enable_anim',           'Anim',           100, default = 0, help = 'Enable sequence render')
+		self.gui_anim_cache     = GUI_Toggle('config', 'enable_anim_cache',     'Cache',          100, default = 0, help = 'Write static objects once and transform-only meshes once for the sequence')
 		self.gui_preview        = GUI_Toggle('config', 'enable_preview',        'Preview',        100, default = 0, help = 'Enable preview')
 		self.gui_error          = GUI_Toggle('config', 'enable_error',          'Enable error',   100, default = 0, help = 'Enable error file')
 
 		self.gui_button_error    = GUI_Button('local', None, 'Save:',     100, func = self.cb_error_filename, help = 'Select log file (default: ">>gelato_log.txt")', sep = 0)
 		self.gui_button_filename = GUI_Button('local', None, 'Filename:', 100, func = self.cb_filename,       help = 'Select file name', sep = 0)
+		self.gui_button_store_gc = GUI_Button('local', None, 'Clean store', 100, func = self.cb_store_gc,     help = 'Remove the store files not referenced by any export')
 
 		self.gui_limits_threads = GUI_Number('config', 'limits_threads', 'Threads: ', 100, 1, 256,  default = 1,  help = 'Sets the maximum number of parallel execution threads')
 		self.gui_bucketsize_x   = GUI_Number('config', 'bucketsize_x',   'X: ',       105, 1, 1000, default = 32, help = 'Bucket size of pixel rectangles X', sep = 0)
@@ -4413,6 +6422,21 @@ class GUI_Config(object):
 
 		GUI_Base.line_feed()
 
+		self.gui_incremental.draw()
+		self.gui_store.draw()
+
+		if (self.gui_store.val):
+			self.gui_button_store_gc.draw()
+
+		GUI_Base.line_feed()
+
+		self.gui_material_library.draw()
+
+		if (USE_GELATOSNAP):
+			self.gui_snapshot.draw()
+
+		GUI_Base.line_feed()
+
 		GUI_Text.draw(self.color_text, 'Maximum threads:', 100, 2, 6)
 		self.gui_auto.draw()
 
@@ -4432,6 +6456,7 @@ class GUI_Config(object):
 		self.gui_anim.draw()
 
 		if (self.gui_anim.val):
+			self.gui_anim_cache.draw()
 			self.gui_files_extensions.draw()
 
 		GUI_Base.line_feed()
@@ -4756,6 +6781,9 @@ class GUI_Config(object):
 		self.gui_frames_transformation = GUI_Number('config', 'frames_transformation', 'Frames transformation: ', 180, 2,   9999,   default = 2,   help = 'Number of frames moion blur transformation')
 		self.gui_frames_deformation    = GUI_Number('config', 'frames_deformation',    'Frames deformation: ',    180, 2,   9999,   default = 2,   help = 'Number of frames moion blur deformation')
 		self.gui_dice_motionfactor     = GUI_Number('config', 'dice_motionfactor',     'Motion factor: ',         180, 0.0, 1000.0, default = 1.0, help = 'Scaling for decreased tessellation and shading for moving objects')
+		self.gui_motion_error          = GUI_Number('config', 'motion_error',          'Max error: ',             180, 0.0, 100.0,  default = 0.5, help = 'Maximum screen error in pixels of the adaptive motion samples')
+
+		self.gui_enable_adaptive_motion = GUI_Toggle('config', 'enable_adaptive_motion', 'Adaptive', 100, default = 0, help = 'Enable adaptive number of motion samples per object')
 
 		self.gui_shutter_open  = GUI_String('config', 'shutter_open',  'Shutter open: ',  180, 20, default = '0.0', help = 'Shutter open time for motion blur')
 		self.gui_shutter_close = GUI_String('config', 'shutter_close', 'Shutter close: ', 180, 20, default = '0.5', help = 'Shutter close time for motion blur')
@@ -4780,12 +6808,21 @@ class GUI_Config(object):
 			self.gui_ray_motion.draw()
 			self.gui_dice_motionfactor.draw()
 
+			GUI_Base.line_feed()
+
+			self.gui_enable_adaptive_motion.draw()
+
+			if (self.gui_enable_adaptive_motion.val):
+				self.gui_motion_error.draw()
+
 	def panel_ray_traced_init(self):
 
 		self.gui_enable_ray_traced = GUI_Toggle('config', 'enable_ray_traced', 'Enable', 100, default = 0, help = 'Enable ray traced reflections and refractions')
 
 		self.gui_ray_traced_max_depth = GUI_Number('config', 'ray_traced_max_depth','Raytraced max depth: ', 210, 0, 32, default = 1, help = 'Ray traced max depth')
 
+		self.gui_ray_traced_selective = GUI_Toggle('config', 'ray_traced_selective', 'Selective', 100, default = 0, help = 'Reflection and refraction sets with only the objects with traceable materials and the ray traced property, empty if no material traces rays')
+
 	def panel_ray_traced(self):
 
 		self.gui_enable_ray_traced.draw()
@@ -4793,6 +6830,7 @@ class GUI_Config(object):
 		if (self.gui_enable_ray_traced.val):
 
 			self.gui_ray_traced_max_depth.draw()
+			self.gui_ray_traced_selective.draw()
 
 	def panel_displacement_init(self):
 
@@ -4807,8 +6845,12 @@ class GUI_Config(object):
 
 		self.gui_menu_displacement = GUI_Menu('local', None, 130, func = self.cb_menu_displacement, help = 'Select displacement')
 
+		self.gui_disp_maxradius = GUI_Number('local', None, 'Bound: ', 140, 0.0, 10000.0, default = 0.0, func = self.cb_disp_maxradius, help = 'Maximum radial displacement of the shader (0 = max radius)')
+
 	def panel_displacement(self):
 
+		self.load_shaders()
+
 		enable_displacements = self.gui_enable_displacements.val
 
 		if (enable_displacements):
@@ -4852,6 +6894,19 @@ class GUI_Config(object):
 						else:
 							self.gui_button_disp_remove.draw()
 
+							try:
+								mat = Blender.Material.Get(material_name)
+							except:
+								mat = None
+
+							if (mat is not None):
+								try:
+									maxradius = float(property_number_get(mat, 'maxradius', 0.0))
+								except (ValueError, TypeError):
+									maxradius = 0.0
+
+								self.gui_disp_maxradius.draw(maxradius)
+
 							GUI_Base.line_feed()
 
 							sd.draw()
@@ -4960,6 +7015,9 @@ class GUI_Config(object):
 		self.gui_geo_mb_transformation = GUI_Toggle('local', None, 'Motion blur transformation', 160, func = self.cb_geo_mb_transformation, help = 'Enable motion blur transformation')
 		self.gui_geo_mb_deformation    = GUI_Toggle('local', None, 'Motion blur deformation',    160, func = self.cb_geo_mb_deformation,    help = 'Enable motion blur deformation')
 		self.gui_geo_enable_proxy      = GUI_Toggle('local', None, 'Enable proxy',               130, func = self.cb_geo_enable_proxy,      help = 'Enable proxy file')
+		self.gui_geo_motion_samples    = GUI_Number('local', None, 'Motion samples: ',          160, 0, 9999, default = 0, func = self.cb_geo_motion_samples, help = 'Number of motion samples (0 = all frames or adaptive)')
+		self.gui_geo_ray_traced        = GUI_Toggle('local', None, 'Ray traced',                 130, func = self.cb_geo_ray_traced,        help = 'Visible in reflections and refractions (selective ray traced)')
+		self.gui_geo_all_primvars      = GUI_Toggle('local', None, 'All attributes',             130, func = self.cb_geo_all_primvars,      help = 'Export normals, vertex colors and UV in all passes (custom shaders)')
 
 		self.gui_button_proxy_file = GUI_Button('local', None, 'Proxy file:', 100, func = self.cb_button_proxy_file, help = 'Select proxy file', sep = 0)
 
@@ -5026,6 +7084,11 @@ class GUI_Config(object):
 					indirect_light = property_boolean_get(obj, 'indirect_light', True)
 					self.gui_geo_indirect_light.draw(indirect_light)
 
+				if (self.gui_enable_ray_traced.val and self.gui_ray_traced_selective.val):
+
+					ray_traced = property_boolean_get(obj, 'ray_traced', True)
+					self.gui_geo_ray_traced.draw(ray_traced)
+
 				if (self.gui_enable_motion_blur.val):
 
 					GUI_Base.line_feed()
@@ -5036,10 +7099,16 @@ class GUI_Config(object):
 					motionblur_deformation = property_boolean_get(obj, 'motionblur_deformation')
 					self.gui_geo_mb_deformation.draw(motionblur_deformation)
 
+					motion_samples = int(property_number_get(obj, 'motion_samples'))
+					self.gui_geo_motion_samples.draw(motion_samples)
+
 					GUI_Base.line_feed()
 
 				GUI_Base.line_feed()
 
+				all_primvars = property_boolean_get(obj, 'all_primvars')
+				self.gui_geo_all_primvars.draw(all_primvars)
+
 				self.gui_geo_enable_proxy.draw(enable_proxy)
 
 				if (enable_proxy):
@@ -5194,6 +7263,7 @@ class GUI_Config(object):
 		w = 130
 
 		self.gui_enable_shaders = GUI_Toggle('config', 'enable_shaders', 'Enable', 130, default = 1, help = 'Enable all shaders')
+		self.gui_compile_shaders = GUI_Toggle('config', 'enable_compile_shaders', 'Compile GSL', 130, default = 0, help = 'At startup compile the GSL sources newer than their compiled shaders')
 
 		self.gui_mat_enable_postscript = GUI_Toggle('local', None, 'Post-script', w, func = self.cb_mat_enable_postscript, help = 'Enable shader post-script')
 		self.gui_mat_enable_script     = GUI_Toggle('local', None, 'Script',      w, func = self.cb_mat_enable_script,     help = 'Enable shader script')
@@ -5217,6 +7287,8 @@ class GUI_Config(object):
 
 	def panel_shaders(self):
 
+		self.load_shaders()
+
 		enable_script  = False
 		enable_shaders = self.gui_enable_shaders.val
 
@@ -5227,9 +7299,12 @@ class GUI_Config(object):
 			GUI_Base.line_feed()
 
 		self.gui_enable_shaders.draw()
+		self.gui_compile_shaders.draw()
 
 		if (enable_shaders):
 
+			GUI_Base.line_feed()
+
 			self.gui_shadingquality.draw()
 			self.gui_limits_gridsize.draw()
 
@@ -5374,6 +7449,9 @@ class GUI_Config(object):
 
 		self.gui_lights_factor = GUI_Slider('config', 'lights_factor', 'Lights factor: ', 320, 0.0, 1000.0, default = 50.0, help = 'Lights factor')
 
+		self.gui_enable_lights_culling = GUI_Toggle('config', 'enable_lights_culling', 'Culling',      130, default = 0, help = 'Enable culling of the lamps with a low contribution over the camera frustum')
+		self.gui_lights_threshold      = GUI_Number('config', 'lights_threshold',      'Threshold: ', 160, 0.0, 1000.0, default = 0.1, help = 'Minimum contribution of a lamp (intensity / distance^2)')
+
 		self.gui_menu_light = GUI_Menu('local', None, 130, func = self.cb_gui_menu_light, help = 'Select shader')
 		self.gui_menu_lamp  = GUI_Menu('local', None, 130, help = 'Select lamp')
 
@@ -5383,6 +7461,8 @@ class GUI_Config(object):
 
 	def panel_lights(self):
 
+		self.load_shaders()
+
 		enable_script = False
 		enable_lights = self.gui_enable_lights.val
 
@@ -5401,6 +7481,13 @@ class GUI_Config(object):
 
 			GUI_Base.line_feed()
 
+			self.gui_enable_lights_culling.draw()
+
+			if (self.gui_enable_lights_culling.val):
+				self.gui_lights_threshold.draw()
+
+			GUI_Base.line_feed()
+
 			obj = self.active_obj
 			obj_ok = (obj and (obj.type == 'Lamp'))
 			if (not obj_ok):
@@ -5620,114 +7707,162 @@ class GUI_Config(object):
 
 				shader_bake_diffuse.draw()
 
-	def config_save(self):
+	def config_body(self):
+		"""
+		Elements of the config file, without the root element
+		"""
 
-		# write xml file
+		escape    = xml.sax.saxutils.escape
+		quoteattr = xml.sax.saxutils.quoteattr
 
-		dom = xml.dom.minidom.getDOMImplementation()
-		doctype = dom.createDocumentType(ROOT_ELEMENT, None, None)
+		body  = []
+		write = body.append
 
-		doc = dom.createDocument(None, ROOT_ELEMENT, doctype )
+		write('  <config>\n')
 
-		root = doc.documentElement
-		doc.appendChild(root)
+		config = [(g.name, g.internal_val) for g in GUI_Base.registry('config') if g.name is not None]
+		config.sort(cmp = lambda a, b: cmp(a[0], b[0]))
 
-		root.setAttribute('version', __version__)
-		root.setAttribute('timestamp', datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S'))
-		root.setAttribute('scene', Blender.Scene.GetCurrent().name)
+		for (name, value) in config:
+			write('    <%s>%s</%s>\n' % (name, escape(str(value).strip()), name))
 
-		try:
-			root.setAttribute('user', getpass.getuser())
-			root.setAttribute('hostname', socket.gethostname())
-		except:
-			pass
+		write('  </config>\n')
 
-		root.setAttribute('blender', str(Blender.Get('version')))
-		root.setAttribute('platform', sys.platform)
+		# materials
 
-		head = doc.createElement('config')
-		root.appendChild(head)
+		blender_materials = set([m.name for m in Blender.Material.Get()])
 
-		config = [(g.name, g.internal_val) for g in GUI_Base.registry('config') if g.name is not None]
-		config.sort(cmp = lambda a, b: cmp(a[0], b[0]))
+		for (idx, ml) in enumerate(self.assigned_material):
+
+			write('  <materials index="%d">\n' % idx)
+
+			for (mat, sd) in sorted(ml.iteritems()):
+
+				if (((idx > 0) and (mat not in blender_materials)) or (sd is None)):
+					continue
+
+				if ((idx > 0) and (sd.enable_sss)):
+					write('    <material name=%s enable_sss="%d" sss_parameter=%s>\n' % (quoteattr(mat), int(sd.enable_sss), quoteattr(sd.sss)))
+				else:
+					write('    <material name=%s>\n' % quoteattr(mat))
+
+				sd.toxml(write, '      ')
+
+				write('    </material>\n')
+
+			write('  </materials>\n')
+
+		# displacements
+
+		for (idx, ds) in enumerate(self.assigned_displacement):
+
+			write('  <displacements index="%d">\n' % idx)
+
+			for (dis, sd) in sorted(ds.iteritems()):
+
+				if (sd is None):
+					continue
+
+				write('    <displacement name=%s>\n' % quoteattr(dis))
+
+				sd.toxml(write, '      ')
+
+				write('    </displacement>\n')
+
+			write('  </displacements>\n')
+
+		# lights
+
+		for (idx, lg) in enumerate(self.assigned_light):
+
+			write('  <lights index="%d">\n' % idx)
+
+			for (lig, sd) in sorted(lg.iteritems()):
 
-		for (name, value) in config:
+				if (sd is None):
+					continue
 
-			elem = doc.createElement(name)
-			head.appendChild(elem)
-			elem.appendChild(doc.createTextNode(str(value).strip()))
+				if ((idx > 0) and (sd.enable_shadow)):
+					write('    <light name=%s enable_shadow="%d" shadow_parameter=%s>\n' % (quoteattr(lig), int(sd.enable_shadow), quoteattr(sd.shadow)))
+				else:
+					write('    <light name=%s>\n' % quoteattr(lig))
 
-		sc = Blender.Scene.GetCurrent()
+				sd.toxml(write, '      ')
 
-		for (name, value) in [(g.name, g.internal_val) for g in GUI_Base.registry('blend') if g.name is not None]:
-			property_set(sc, name, value)
+				write('    </light>\n')
 
-		# materials
+			write('  </lights>\n')
 
-		blender_materials = [m.name for m in Blender.Material.Get()]
+		return body
 
-		for (idx, ml) in enumerate(self.assigned_material):
+	def config_signature(self, body):
+		"""
+		Digest of the config contents and of its destination
+		"""
 
-			materials = doc.createElement('materials')
-			root.appendChild(materials)
-			materials.setAttribute('index', str(idx))
+		sc = Blender.Scene.GetCurrent()
 
-			for (mat, sd) in sorted(ml.iteritems()):
+		digest = hashlib.sha1(repr((self.config_filename, property_boolean_get(sc, 'pack_config'))))
 
-				if (((idx > 0) and (mat not in blender_materials)) or (sd is None)):
-					continue
+		for line in body:
+			digest.update(line)
 
-				material = doc.createElement('material')
-				materials.appendChild(material)
-				material.setAttribute('name', mat)
+		return digest.hexdigest()
 
-				if ((idx > 0) and (sd.enable_sss)):
-					material.setAttribute('enable_sss', str(int(sd.enable_sss)))
-					material.setAttribute('sss_parameter', sd.sss)
+	def config_exists(self):
+		sc = Blender.Scene.GetCurrent()
 
-				sd.toxml(doc, material)
+		if (property_boolean_get(sc, 'pack_config')):
+			try:
+				Blender.Text.Get(self.config_filename)
+				return True
+			except:
+				return False
 
-		# displacements
+		return os.path.exists(self.config_filename)
 
-		for (idx, ds) in enumerate(self.assigned_displacement):
+	def config_save(self):
 
-			displacements = doc.createElement('displacements')
-			root.appendChild(displacements)
-			displacements.setAttribute('index', str(idx))
+		sc = Blender.Scene.GetCurrent()
 
-			for (dis, sd) in sorted(ds.iteritems()):
+		for (name, value) in [(g.name, g.internal_val) for g in GUI_Base.registry('blend') if g.name is not None]:
+			property_set(sc, name, value)
 
-				if (sd is None):
-					continue
+		# write only when changed
 
-				displacement = doc.createElement('displacement')
-				displacements.appendChild(displacement)
-				displacement.setAttribute('name', dis)
+		body = self.config_body()
 
-				sd.toxml(doc, displacement)
+		signature = self.config_signature(body)
 
-		# lights
+		if ((signature == self.config_signature_saved) and self.config_exists()):
+			return
 
-		for (idx, lg) in enumerate(self.assigned_light):
+		# root element
 
-			lights = doc.createElement('lights')
-			root.appendChild(lights)
-			lights.setAttribute('index', str(idx))
+		quoteattr = xml.sax.saxutils.quoteattr
 
-			for (lig, sd) in sorted(lg.iteritems()):
+		attributes = [
+			('version',   __version__),
+			('timestamp', datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S')),
+			('scene',     sc.name),
+		]
 
-				if (sd is None):
-					continue
+		try:
+			attributes.append(('user',     getpass.getuser()))
+			attributes.append(('hostname', socket.gethostname()))
+		except:
+			pass
 
-				light = doc.createElement('light')
-				lights.appendChild(light)
-				light.setAttribute('name', lig)
+		attributes.append(('blender',  str(Blender.Get('version'))))
+		attributes.append(('platform', sys.platform))
 
-				if ((idx > 0) and (sd.enable_shadow)):
-					light.setAttribute('enable_shadow', str(int(sd.enable_shadow)))
-					light.setAttribute('shadow_parameter', sd.shadow)
+		head = [
+			'<?xml version="1.0" ?>\n',
+			'<!DOCTYPE %s>\n' % ROOT_ELEMENT,
+			'<%s %s>\n' % (ROOT_ELEMENT, ' '.join(['%s=%s' % (name, quoteattr(value)) for (name, value) in attributes])),
+		]
 
-				sd.toxml(doc, light)
+		tail = ['</%s>\n' % ROOT_ELEMENT]
 
 		if (property_boolean_get(sc, 'pack_config')):
 
@@ -5742,13 +7877,10 @@ class GUI_Config(object):
 
 			try:
 				text = Blender.Text.New(self.config_filename)
-
-				if (USE_XML_DOM_EXT):
-					xml.dom.ext.PrettyPrint(doc, text)
-				else:
-					text.write(doc.toprettyxml(indent = '  ', newl = '\n'))
+				text.write(''.join(head + body + tail))
 			except:
 				sys.excepthook(*sys.exc_info())
+				return
 
 		else:
 			try:
@@ -5766,12 +7898,29 @@ class GUI_Config(object):
 			# write file
 
 			try:
-				if (USE_XML_DOM_EXT):
-					xml.dom.ext.PrettyPrint(doc, fxml.fd)
-				else:
-					doc.writexml(fxml.fd, addindent = '  ', newl = '\n')
+				fxml.fd.writelines(head)
+				fxml.fd.writelines(body)
+				fxml.fd.writelines(tail)
 			except:
 				sys.excepthook(*sys.exc_info())
+				return
+
+		self.config_signature_saved = signature
+
+	def config_value(self, gui, value):
+		try:
+			ty = gui.internal_type
+
+			if (ty is int):
+				gui.internal_val = int(value)
+			elif (ty is float):
+				gui.internal_val = float(value)
+			elif (ty is str):
+				gui.internal_val = str(value).strip()
+			else:
+				print 'Error: file "%s", element "%s" type "%s" unknow' % (self.config_filename, gui.name, ty)
+		except:
+			sys.excepthook(*sys.exc_info())
 
 	def config_load(self, first = False):
 
@@ -5784,19 +7933,7 @@ class GUI_Config(object):
 			except:
 				continue
 
-			try:
-				ty = gui.internal_type
-
-				if (ty is int):
-					gui.internal_val = int(val)
-				elif (ty is float):
-					gui.internal_val = float(val)
-				elif (ty is str):
-					gui.internal_val = str(val)
-				else:
-					print 'Error: file "%s", element "%s" type "%s" unknow' % (self.config_filename, name, ty)
-			except:
-				sys.excepthook(*sys.exc_info())
+			self.config_value(gui, val)
 
 		if (property_boolean_get(sc, 'pack_config')):
 
@@ -5804,7 +7941,7 @@ class GUI_Config(object):
 
 			try:
 				text = Blender.Text.Get(self.config_filename)
-				doc = xml.dom.minidom.parseString(''.join(text.asLines()))
+				fxml = cStringIO.StringIO(''.join(text.asLines()))
 
 			except:
 				if (not first):
@@ -5813,154 +7950,143 @@ class GUI_Config(object):
 
 		else:
 			try:
-				doc = xml.dom.minidom.parse(self.config_filename)
+				fxml = open(self.config_filename, 'rb')
 			except:
 				if (not first):
 					print 'Info: XML config file "%s" not found, will use default settings' % self.config_filename
 				return
 
-		if (doc.documentElement.tagName != ROOT_ELEMENT):
-			print 'Error: file "%s", invalid root element "%s"' % (self.config_filename, doc.documentElement.tagName)
-			return
-
-		head = doc.getElementsByTagName('config')
-		if (len(head) == 0):
-
-			print 'Error: file "%s", not element "config"' % self.config_filename
-		else:
-
-			config = [(g.name, g) for g in GUI_Base.registry('config') if g.name is not None]
-
-			for (name, gui) in config:
-
-				el = head[0].getElementsByTagName(name)
-				if (len(el) == 0):
-					continue
+		try:
+			try:
+				loaded = self.config_parse(fxml)
+			except SyntaxError, strerror:
+				print 'Error: file "%s", %s' % (self.config_filename, strerror)
+				return
+		finally:
+			fxml.close()
 
-				el[0].normalize()
-				nd = el[0].firstChild
-				if (nd.nodeType != xml.dom.Node.TEXT_NODE):
-					continue
+		# the config on disk is now up to date
 
-				try:
-					ty = gui.internal_type
-
-					if (ty is int):
-						gui.internal_val = int(nd.data)
-					elif (ty is float):
-						gui.internal_val = float(nd.data)
-					elif (ty is str):
-						gui.internal_val = str(nd.data.strip())
-					else:
-						print 'Error: file "%s", element "%s" type "%s" unknow' % (self.config_filename, name, ty)
-				except:
-					sys.excepthook(*sys.exc_info())
+		if (loaded):
+			self.config_signature_saved = self.config_signature(self.config_body())
 
-		# materials
+	def config_parse(self, fxml):
+		"""
+		Read the config elements one at a time, each one is freed when processed
+		"""
 
-		blender_materials = [m.name for m in Blender.Material.Get()]
+		config = dict([(g.name, g) for g in GUI_Base.registry('config') if g.name is not None])
 
-		for material in doc.getElementsByTagName('materials'):
+		blender_materials = set([m.name for m in Blender.Material.Get()])
 
-			index = material.getAttribute('index')
-			if (index is None):
-				print 'Error: file "%s", not attribute "index" element "materials"' % self.config_filename
-				continue
+		assigned = {
+			'materials':     (self.assigned_material,     'material'),
+			'displacements': (self.assigned_displacement, 'displacement'),
+			'lights':        (self.assigned_light,        'light'),
+		}
 
-			idx = int(index)
+		depth      = 0
+		section    = None
+		idx        = None
+		has_config = False
 
-			for mat in material.getElementsByTagName('material'):
+		for (event, elem) in ElementTree.iterparse(fxml, ('start', 'end')):
 
-				name = mat.getAttribute('name')
-				if (name is None):
-					continue
+			if (event == 'start'):
+				depth += 1
 
-				if ((idx > 0) and (name not in blender_materials)):
-					continue
+				if (depth == 1):
+					if (elem.tag != ROOT_ELEMENT):
+						print 'Error: file "%s", invalid root element "%s"' % (self.config_filename, elem.tag)
+						return False
 
-				sd = Shader()
+				elif (depth == 2):
+					section = elem.tag
+					idx     = None
 
-				if (not sd.fromxml(mat)):
-					continue
+					if (section == 'config'):
+						has_config = True
 
-				try:
-					enable_sss = mat.getAttribute('enable_sss')
-					if (enable_sss):
-						sd.enable_sss = int(enable_sss)
-				except:
-					sys.excepthook(*sys.exc_info())
+					elif (section in assigned):
+						index = elem.get('index')
+						if (index is None):
+							print 'Error: file "%s", not attribute "index" element "%s"' % (self.config_filename, section)
+						else:
+							idx = int(index)
 
-				try:
-					sss_parameter = mat.getAttribute('sss_parameter')
-					if (sss_parameter):
-						sd.sss = str(sss_parameter).strip()
-				except:
-					sys.excepthook(*sys.exc_info())
+				continue
 
-				self.assigned_material[idx][name] = sd
+			depth -= 1
 
-		# displacements
+			if (depth == 2):
 
-		for displacement in doc.getElementsByTagName('displacements'):
+				# config
 
-			index = displacement.getAttribute('index')
-			if (index is None):
-				print 'Error: file "%s", not attribute "index" element "displacements"' % self.config_filename
-				continue
+				if (section == 'config'):
 
-			idx = int(index)
+					gui = config.get(elem.tag)
+					if ((gui is not None) and ((elem.text is not None) or (gui.internal_type is str))):
+						self.config_value(gui, elem.text or '')
 
-			for dis in displacement.getElementsByTagName('displacement'):
+				# materials, displacements, lights
 
-				name = dis.getAttribute('name')
-				if (name is None):
-					continue
+				elif (idx is not None):
 
-				sd = Shader()
+					(data, tag) = assigned[section]
 
-				if (not sd.fromxml(dis)):
-					continue
+					name = elem.get('name')
 
-				self.assigned_displacement[idx][name] = sd
+					if ((elem.tag == tag) and (name is not None)):
 
+						if ((section == 'materials') and (idx > 0) and (name not in blender_materials)):
+							elem.clear()
+							continue
 
-		# lights
+						sd = Shader()
 
-		for light in doc.getElementsByTagName('lights'):
+						if (sd.fromxml(elem)):
 
-			index = light.getAttribute('index')
-			if (index is None):
-				print 'Error: file "%s", not attribute "index" element "lights"' % self.config_filename
-				continue
+							if (section == 'materials'):
+								try:
+									enable_sss = elem.get('enable_sss')
+									if (enable_sss):
+										sd.enable_sss = int(enable_sss)
+								except:
+									sys.excepthook(*sys.exc_info())
 
-			idx = int(index)
+								try:
+									sss_parameter = elem.get('sss_parameter')
+									if (sss_parameter):
+										sd.sss = str(sss_parameter).strip()
+								except:
+									sys.excepthook(*sys.exc_info())
 
-			for lig in light.getElementsByTagName('light'):
+							elif (section == 'lights'):
+								try:
+									enable_shadow = elem.get('enable_shadow')
+									if (enable_shadow):
+										sd.enable_shadow = int(enable_shadow)
+								except:
+									sys.excepthook(*sys.exc_info())
 
-				name = lig.getAttribute('name')
-				if (name is None):
-					continue
+								try:
+									shadow_parameter = elem.get('shadow_parameter')
+									if (shadow_parameter):
+										sd.shadow = str(shadow_parameter).strip()
+								except:
+									sys.excepthook(*sys.exc_info())
 
-				sd = Shader()
+							data[idx][name] = sd
 
-				if (not sd.fromxml(lig)):
-					continue
+				elem.clear()
 
-				try:
-					enable_shadow = lig.getAttribute('enable_shadow')
-					if (enable_shadow):
-						sd.enable_shadow = int(enable_shadow)
-				except:
-					sys.excepthook(*sys.exc_info())
+			elif (depth == 1):
+				elem.clear()
 
-				try:
-					shadow_parameter = lig.getAttribute('shadow_parameter')
-					if (shadow_parameter):
-						sd.shadow = str(shadow_parameter).strip()
-				except:
-					sys.excepthook(*sys.exc_info())
+		if (not has_config):
+			print 'Error: file "%s", not element "config"' % self.config_filename
 
-				self.assigned_light[idx][name] = sd
+		return True
 
 # property
 
@@ -5996,6 +8122,12 @@ def property_string_get(obj, name, default = ''):
 	except KeyError:
 		return default
 
+def property_number_get(obj, name, default = 0):
+	try:
+		return property_get(obj, name)
+	except KeyError:
+		return default
+
 def selected_object(types = None):
 	selected = Blender.Object.GetSelected()
 	if (selected):
@@ -6031,35 +8163,344 @@ def fix_vars(name):
 		return re.sub('\$(\w+)', '%\\1%', name)
 	return name
 
-def search_file(name, paths):
-	for p in paths.split(':'):
+class SearchPath(object):
+	__slots__ = ['paths', 'directories']
+
+	# coarsest timestamp of the filesystems (FAT)
+
+	resolution = 2.0
+
+	def __init__(self):
+		"""
+		Index of the directories of the search paths,
+		each directory is listed once and invalidated by its mtime
+		"""
+
+		self.paths       = {}
+		self.directories = {}
+
+	def invalidate(self):
+		self.directories = {}
+
+	def split(self, paths):
+		directories = self.paths.get(paths)
+
+		if (directories is None):
+			directories = self.paths[paths] = [os.path.expandvars(p) for p in paths.split(':')]
+
+		return directories
+
+	def listing(self, directory):
+		try:
+			mtime = os.path.getmtime(directory)
+		except OSError:
+			return {}
+
+		entry = self.directories.get(directory)
+		if ((entry is not None) and (entry[0] == mtime)):
+			return entry[1]
+
 		try:
-			path = os.path.expandvars(p)
+			files = os.listdir(directory)
+		except OSError:
+			files = []
+
+		names = dict([(os.path.normcase(f), f) for f in files])
+
+		# a file created in the same mtime tick would be missed
+
+		if ((time.time() - mtime) > self.resolution):
+			self.directories[directory] = (mtime, names)
+		elif (directory in self.directories):
+			del self.directories[directory]
+
+		return names
+
+search_path = SearchPath()
+
+def search_file(name, paths):
+	if (os.path.dirname(name)):
+		# not a simple file name
+		for path in search_path.split(paths):
 			filename = os.path.join(path, name)
 			if (os.path.exists(filename)):
 				return filename
-		except:
-			continue
+		return None
+
+	key = os.path.normcase(name)
+
+	for path in search_path.split(paths):
+		if (key in search_path.listing(path)):
+			return os.path.join(path, name)
 	return None
 
 def find_files(pattern, paths):
 	fdict = {}
-	for p in paths.split(':'):
+	for path in search_path.split(paths):
+		for f in fnmatch.filter(search_path.listing(path).values(), pattern):
+			fdict[f] = path
+	return fdict
+
+def store_collect(directory, ext, extensions = ()):
+	"""
+	Remove the store files not referenced by the exported files:
+	the files of the output directory tree and the files they include
+	"""
+
+	store = os.path.join(directory, STORE_DIRECTORY)
+
+	try:
+		blobs = fnmatch.filter(os.listdir(store), '*' + ext)
+	except OSError:
+		return (0, 0)
+
+	re_input = re.compile(r'Input \("([^"]*)"\)')
+
+	patterns = ['*' + ext] + ['*' + e for e in extensions]
+
+	pending = []
+
+	for (path, dirs, files) in os.walk(directory):
+		if ((STORE_DIRECTORY in dirs) and (os.path.normcase(os.path.join(path, STORE_DIRECTORY)) == os.path.normcase(store))):
+			dirs.remove(STORE_DIRECTORY)
+
+		for pattern in patterns:
+			pending.extend([os.path.join(path, f) for f in fnmatch.filter(files, pattern)])
+
+	scanned    = set()
+	referenced = set()
+
+	while (pending):
+		filename = os.path.normcase(os.path.abspath(pending.pop()))
+
+		if (filename in scanned):
+			continue
+
+		scanned.add(filename)
+
 		try:
-			path = os.path.expandvars(p)
-			files = os.listdir(path)
-			for f in fnmatch.filter(files, pattern):
-				fdict[f] = path
-		except:
+			fin = open(filename, 'rb')
+		except IOError:
 			continue
-	return fdict
+
+		try:
+			for line in fin:
+				if ('Input' not in line):
+					continue
+
+				for name in re_input.findall(line):
+					referenced.add(os.path.basename(name))
+
+					# follow the includes written out of the directory tree
+
+					if (not os.path.isabs(name)):
+						name = os.path.join(directory, name)
+
+					if ((os.path.splitext(name)[1] == ext) and os.path.isfile(name) and
+						(os.path.normcase(os.path.dirname(os.path.abspath(name))) != os.path.normcase(os.path.abspath(store)))):
+							pending.append(name)
+		finally:
+			fin.close()
+
+	removed = 0
+
+	for f in blobs:
+		if (f in referenced):
+			continue
+		try:
+			os.unlink(os.path.join(store, f))
+			removed += 1
+		except OSError:
+			pass
+
+	return (removed, len(blobs) - removed)
+
+def cpu_count():
+	try:
+		return max(1, int(os.sysconf('SC_NPROCESSORS_ONLN')))
+	except:
+		pass
+
+	try:
+		return max(1, int(os.environ['NUMBER_OF_PROCESSORS']))
+	except:
+		return 1
+
+def parallel_map(function, items, threads = None):
+	"""
+	Apply function to the items with a bounded pool of threads,
+	the results keep the order of the items
+	"""
+
+	items = list(items)
+	results = [None] * len(items)
+
+	if (threads is None):
+		threads = cpu_count()
+
+	threads = min(threads, len(items))
+
+	if (threads <= 1):
+		return [function(item) for item in items]
+
+	lock = threading.Lock()
+	jobs = iter(enumerate(items))
+
+	def worker():
+		while True:
+			lock.acquire()
+			try:
+				try:
+					(idx, item) = jobs.next()
+				except StopIteration:
+					return
+			finally:
+				lock.release()
+
+			try:
+				results[idx] = function(item)
+			except:
+				sys.excepthook(*sys.exc_info())
+
+	workers = [threading.Thread(target = worker) for i in xrange(threads)]
+
+	for w in workers:
+		w.setDaemon(True)
+		w.start()
+
+	for w in workers:
+		w.join()
+
+	return results
+
+def gsl_includes(filename, paths, memo):
+	"""
+	Files included by a GSL source, recursively,
+	memo keeps the includes read from each source
+	"""
+
+	includes = set()
+	stack = [filename]
+
+	while stack:
+		source = stack.pop()
+
+		try:
+			key = (source, os.path.getmtime(source))
+		except OSError:
+			continue
+
+		names = memo.get(key)
+
+		if (names is None):
+			names = []
+
+			try:
+				fsource = open(source, 'r')
+			except IOError:
+				continue
+
+			try:
+				for line in fsource:
+					match = RE_INCLUDE.match(line)
+					if (match):
+						names.append(match.group(1))
+			finally:
+				fsource.close()
+
+			memo[key] = names
+
+			if ((shader_cache is not None) and (memo is shader_cache.includes)):
+				shader_cache.changed = True
+
+		directory = os.path.dirname(source)
+
+		for name in names:
+			include = os.path.join(directory, name)
+			if (not os.path.exists(include)):
+				include = search_file(name, paths)
+
+			if (include and (include not in includes)):
+				includes.add(include)
+				stack.append(include)
+
+	return includes
+
+def gsl_compile(source):
+	(directory, filename) = os.path.split(source)
+
+	# explicit output, the same target checked by compile_shaders
+
+	cmd = [GSLC, '-o', os.path.splitext(filename)[0] + '.gso', filename]
+
+	try:
+		proc = subprocess.Popen(cmd, cwd = (directory or None), stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+	except OSError:
+		print 'Error: command "%s"' % ' '.join(cmd)
+		return False
+
+	output = proc.communicate()[0]
+
+	if (proc.returncode != 0):
+		print 'Error: compile shader "%s"\n%s' % (source, output)
+		return False
+
+	if (Sbase.verbose > 0):
+		print 'Info: compiled shader "%s"' % source
+
+	return True
+
+def compile_shaders(paths):
+	"""
+	Compile in parallel the GSL sources newer than their compiled
+	shaders (or than the files they include)
+	"""
+
+	# includes of the sources, kept across startups in the shaders cache
+
+	if (shader_cache is not None):
+		memo = shader_cache.includes
+	else:
+		memo = {}
+
+	sources = []
+
+	for (filename, path) in sorted(find_files('*.gsl', paths).iteritems()):
+
+		source = os.path.join(path, filename)
+		target = os.path.splitext(source)[0] + '.gso'
+
+		try:
+			mtime = os.path.getmtime(target)
+		except OSError:
+			sources.append(source)
+			continue
+
+		for dependency in [source] + list(gsl_includes(source, paths, memo)):
+			try:
+				if (os.path.getmtime(dependency) > mtime):
+					sources.append(source)
+					break
+			except OSError:
+				continue
+
+	if (not sources):
+		return 0
+
+	compiled = len([compiled for compiled in parallel_map(gsl_compile, sources) if compiled])
+
+	# the listings miss the new compiled shaders
+
+	search_path.invalidate()
+
+	return compiled
 
 # main
 
 def main():
-	global GELATO, GSOINFO, MAKETX
-	global ROOT_ELEMENT, INTERACTIVE, CMD_MASK
-	global gelato_gui, pyg
+	global GELATO, GSLC, GSOINFO, MAKETX
+	global ROOT_ELEMENT, INTERACTIVE
+	global gelato_gui, pyg, shader_cache
 
 	print 'Info: Blendergelato version', __version__
 
@@ -6077,8 +8518,6 @@ def main():
 
 	# programs
 
-	CMD_MASK = ('""%s" "%s""' if (WINDOWS) else '"%s" "%s"')
-
 	GELATO	= 'gelato'
 	GSLC    = 'gslc'
 	GSOINFO = 'gsoinfo'
@@ -6104,6 +8543,10 @@ def main():
 	else:
 		print 'Info: GELATOHOME environment variable not set'
 
+	# shaders signatures
+
+	shader_cache = ShaderCache(os.path.join(os.path.expanduser('~'), '.blendergelato_shaders.cache'))
+
 	# gelato convert
 
 	pyg = Gelato_pyg()
@@ -6126,7 +8569,14 @@ def main():
 	# load, init, load and save
 
 	gelato_gui.config_load(True)
+
+	# compile shaders
+
+	if (gelato_gui.gui_compile_shaders.val):
+		compile_shaders(gelato_gui.gui_path_shader.val)
+
 	gelato_gui.post_init()
+	shader_cache.save()
 	gelato_gui.config_load()
 	gelato_gui.config_save()
 
@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+"""
+Blender Gelato scene snapshot.
+
+A snapshot holds the export of a frame without the array encoding:
+the pyg text of every file, with all the includes and store files it
+references, and the geometry arrays as typed binary blocks (floats in
+double precision). The pyg files are generated from the snapshot
+without Blender, on any machine.
+
+The names of the files in the directory of the snapshot, and the same
+paths in the pyg text, are stored relative to it: the files can be
+generated in any output directory.
+
+Passes, split mode and the other output settings are those of the
+export; only the arrays encoding (ASCII or binary) can be changed.
+
+File layout:
+
+	magic 'GSNP', version (uint32), index size (uint32)
+	index (marshal)
+	padding to 8 bytes
+	arrays (byte order of the index)
+"""
+
+__author__ = 'Mario Ambrogetti'
+__version__ = '0.19a'
+
+# NVIDIA Gelato(TM) Exporter
+#
+# Original By: Mario Ambrogetti
+# Date:        Wed, 03 Sep 2008 14:52:40 +0200
+#
+# ***** BEGIN GPL LICENSE BLOCK *****
+#
+# Script copyright (C) Mario Ambrogetti
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 59 Temple Place - Suite 330, Boston, MA  02111-1307, USA.
+#
+# ***** END GPL LICENCE BLOCK *****
+
+import sys, os
+import struct, marshal, mmap, array, tempfile
+
+MAGIC   = 'GSNP'
+VERSION = 2
+
+# directory of the snapshot in the pyg text
+
+ROOT = '\0root\0'
+
+HEADER = '<4sII'
+ALIGN  = 8
+
+# pyg binary arrays
+
+if (sys.byteorder == 'little'):
+	BINARY_INT   = 0200
+	BINARY_FLOAT = 0202
+else:
+	BINARY_INT   = 0201
+	BINARY_FLOAT = 0203
+
+class SnapshotError(Exception):
+	def __init__(self, message):
+		self.message = message
+
+	def __str__(self):
+		return self.message
+
+class SnapshotFile(object):
+	__slots__ = ['snapshot', 'name', 'records', 'text']
+
+	def __init__(self, snapshot, name):
+		"""
+		File of the snapshot, it records text and arrays
+		"""
+
+		self.snapshot = snapshot
+		self.name     = name
+		self.records  = []
+		self.text     = []
+
+	def write(self, text):
+		self.text.append(text)
+
+	def write_array(self, typecode, values, ascii = False):
+		self.flush()
+		self.records.append(self.snapshot.add_array(typecode, values) + (ascii,))
+
+	def flush(self):
+		if (self.text):
+			self.records.append(self.snapshot.relative_text(''.join(self.text)))
+			self.text = []
+
+	def close(self):
+		self.flush()
+
+class SnapshotWriter(object):
+	__slots__ = ['filename', 'options', 'files', 'arrays', 'size', 'root', 'prefixes']
+
+	def __init__(self, filename, **options):
+		"""
+		Snapshot of a frame, written on close
+		"""
+
+		self.filename = filename
+		self.options  = options
+		self.files    = []
+		self.arrays   = []
+		self.size     = 0
+
+		self.root = os.path.dirname(os.path.abspath(filename))
+
+		# the root as written in the pyg text (escaped on Windows)
+
+		prefix = os.path.join(self.root, '')
+
+		self.prefixes = [prefix]
+		if (os.path.sep == '\\'):
+			self.prefixes.insert(0, prefix.replace('\\', '\\\\'))
+
+	def relative_name(self, name):
+		"""
+		Name relative to the snapshot with '/' separators,
+		absolute if out of its directory
+		"""
+
+		name = os.path.abspath(name)
+
+		prefix = self.prefixes[-1]
+
+		if (os.path.normcase(name).startswith(os.path.normcase(prefix))):
+			return '/'.join(name[len(prefix):].split(os.path.sep))
+
+		return name
+
+	def relative_text(self, text):
+		for prefix in self.prefixes:
+			text = text.replace(prefix, ROOT)
+		return text
+
+	def open(self, name):
+		sfile = SnapshotFile(self, self.relative_name(name))
+		self.files.append(sfile)
+		return sfile
+
+	def add_array(self, typecode, values):
+		data = array.array(typecode, values)
+
+		offset = self.size
+
+		self.arrays.append(data)
+		self.size += data.itemsize * len(data)
+
+		return (typecode, offset, len(data))
+
+	def close(self):
+		for sfile in self.files:
+			sfile.close()
+
+		index = marshal.dumps({
+			'byteorder': sys.byteorder,
+			'options':   self.options,
+			'files':     [(sfile.name, sfile.records) for sfile in self.files],
+		})
+
+		header = struct.pack(HEADER, MAGIC, VERSION, len(index))
+
+		padding = -(len(header) + len(index)) % ALIGN
+
+		directory = os.path.dirname(self.filename) or os.curdir
+
+		(handle, tmpname) = tempfile.mkstemp('.snap', 'gelato', directory)
+
+		fout = os.fdopen(handle, 'wb')
+
+		try:
+			fout.write(header)
+			fout.write(index)
+			fout.write('\0' * padding)
+
+			for data in self.arrays:
+				data.tofile(fout)
+		finally:
+			fout.close()
+
+		if (os.path.exists(self.filename)):
+			os.unlink(self.filename)
+
+		os.rename(tmpname, self.filename)
+
+class Snapshot(object):
+	__slots__ = ['filename', 'fd', 'map', 'index', 'start', 'swap']
+
+	def __init__(self, filename):
+		"""
+		Read a snapshot, the arrays are mapped in memory
+		"""
+
+		self.filename = filename
+
+		self.fd = open(filename, 'rb')
+
+		try:
+			size = struct.calcsize(HEADER)
+
+			(magic, version, length) = struct.unpack(HEADER, self.fd.read(size))
+
+			if ((magic != MAGIC) or (version != VERSION)):
+				raise SnapshotError, 'Invalid snapshot "%s"' % filename
+
+			self.index = marshal.loads(self.fd.read(length))
+
+			self.start = size + length
+			self.start += -self.start % ALIGN
+
+			self.fd.seek(0, 2)
+
+			if (self.fd.tell() > self.start):
+				self.map = mmap.mmap(self.fd.fileno(), 0, access = mmap.ACCESS_READ)
+			else:
+				self.map = ''
+		except:
+			self.fd.close()
+			raise
+
+		self.swap = (self.index['byteorder'] != sys.byteorder)
+
+	def close(self):
+		if (self.map):
+			self.map.close()
+		self.fd.close()
+
+	def options(self):
+		return self.index['options']
+
+	def files(self):
+		return self.index['files']
+
+	def array(self, typecode, offset, count):
+		data = array.array(typecode)
+
+		begin = self.start + offset
+
+		data.fromstring(self.map[begin:begin + data.itemsize * count])
+
+		if (self.swap):
+			data.byteswap()
+
+		return data
+
+	@staticmethod
+	def single(data):
+		try:
+			return array.array('f', data)
+		except OverflowError:
+			single = array.array('f')
+			for f in data:
+				try:
+					single.append(f)
+				except OverflowError:
+					single.append(0.0)
+			return single
+
+	def write_array(self, wfile, record, binary, precision):
+		(typecode, offset, count, ascii) = record
+
+		if (count == 0):
+			return
+
+		data = self.array(typecode, offset, count)
+
+		if (binary and not ascii):
+			wfile.write(struct.pack('=BI', (BINARY_INT if (typecode == 'i') else BINARY_FLOAT), count))
+
+			# binary floats are single precision
+
+			if (typecode == 'd'):
+				data = self.single(data)
+
+			data.tofile(wfile)
+
+		elif (typecode == 'i'):
+			wfile.write('(%s)' % ','.join([str(i) for i in data]))
+		else:
+			wfile.write('(%s)' % ','.join([str(round(f, precision)) for f in data]))
+
+	def generate(self, binary = None, names = None, directory = None):
+		"""
+		Generate the pyg files of the snapshot in directory
+		(default the directory of the snapshot)
+		"""
+
+		options = self.options()
+
+		if (binary is None):
+			binary = options.get('binary', False)
+
+		precision = options.get('precision', 6)
+
+		if (directory is None):
+			directory = os.path.dirname(os.path.abspath(self.filename))
+
+		root = os.path.join(os.path.abspath(directory), '')
+		if (os.path.sep == '\\'):
+			root = root.replace('\\', '\\\\')
+
+		generated = []
+
+		for (name, records) in self.files():
+
+			if ((names is not None) and (name not in names)):
+				continue
+
+			filename = os.path.join(directory, *name.split('/'))
+
+			try:
+				parent = os.path.dirname(filename)
+				if (parent and (not os.path.isdir(parent))):
+					os.makedirs(parent)
+
+				wfile = open(filename, 'wb')
+			except (IOError, OSError):
+				raise SnapshotError, 'Cannot write file "%s"' % filename
+
+			try:
+				for record in records:
+					if (type(record) is str):
+						wfile.write(record.replace(ROOT, root))
+					else:
+						self.write_array(wfile, record, binary, precision)
+			finally:
+				wfile.close()
+
+			generated.append(filename)
+
+		return generated
+
+def main():
+	import optparse
+
+	parser = optparse.OptionParser(usage = '%prog [options] snapshot ...', version = '%prog ' + __version__)
+
+	parser.add_option('-b', '--binary', action = 'store_true', dest = 'binary', default = None, help = 'write binary arrays')
+	parser.add_option('-a', '--ascii',  action = 'store_false', dest = 'binary', help = 'write ASCII arrays')
+	parser.add_option('-l', '--list',   action = 'store_true', dest = 'list', default = False, help = 'list the files of the snapshots')
+	parser.add_option('-f', '--file',   action = 'append', dest = 'names', default = None, help = 'generate only this file, relative to the snapshot (repeatable)')
+	parser.add_option('-o', '--output', action = 'store', dest = 'directory', default = None, help = 'output directory (default: directory of the snapshot)')
+	parser.add_option('-v', '--verbose', action = 'store_true', dest = 'verbose', default = False, help = 'verbose')
+
+	(options, args) = parser.parse_args()
+
+	if (not args):
+		parser.error('no snapshot')
+
+	for filename in args:
+		try:
+			snap = Snapshot(filename)
+		except (IOError, SnapshotError), strerror:
+			print >> sys.stderr, 'Error: %s' % strerror
+			return 1
+
+		try:
+			if (options.list):
+				for (name, records) in snap.files():
+					print name
+				continue
+
+			try:
+				generated = snap.generate(options.binary, options.names, options.directory)
+			except SnapshotError, strerror:
+				print >> sys.stderr, 'Error: %s' % strerror
+				return 1
+
+			if (options.verbose):
+				for name in generated:
+					print 'Info: generated "%s"' % name
+		finally:
+			snap.close()
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())